@@ -1,21 +1,135 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+import logging
 import sqlite3
-import re
 import os
 import json
 import sqlite3
 import os
-from database_builder import get_database_connection
-import gzip
-from flask import make_response, jsonify
+import time
+from database_builder import (MTGDatabase, find_cards, find_printings, normalize_name,
+                              open_read_only, rarity_group_for)
+from card_index import CardIndex
+from fuzzy_index import FuzzyIndex
+from card_parser import parse_decklist
+from refresher import Refresher, SnapshotBusy, snapshot_lock
+from compression import ResponseCompressor, choose_encoding
+from result_cache import ResultCache
+from instrumentation import Instrumentation, configure_logging
+from metrics import registry as metrics_registry, snapshot_gauges
+import threading
 
 app = Flask(__name__)
 
-from flask_compress import Compress
+configure_logging()
+logger = logging.getLogger('mtg.app')
 
-# After app = Flask(__name__)
-compress = Compress()
-compress.init_app(app)
+# Per-stage timers reported as Server-Timing; after_request hooks run in
+# reverse order, so this is registered first to see every later stage
+Instrumentation(app)
+
+# Finished responses are cached by content (RESULT_CACHE=memory|disk|off).
+# Registered before the compressor so its hook runs after it and stores the
+# compressed bytes
+result_cache = ResultCache.from_env()
+result_cache.init_app(app)
+
+# Responses are compressed once, after the handler, for whatever the client accepts
+ResponseCompressor(app)
+
+DB_PATH = 'data/mtg_cards.sqlite'
+
+# Optional per-worker in-memory card index (CARD_INDEX=1): lookups then run no SQL
+card_index = CardIndex(DB_PATH) if os.environ.get('CARD_INDEX') == '1' else None
+
+# One read-only connection per request thread, kept open between requests
+_read_local = threading.local()
+
+
+def get_read_connection():
+    """Return this thread's read-only connection, reopening it after a snapshot swap"""
+    inode = os.stat(DB_PATH).st_ino
+    conn = getattr(_read_local, 'conn', None)
+    if conn is None or _read_local.inode != inode:
+        if conn is not None:
+            conn.close()
+        conn = open_read_only(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        _read_local.conn = conn
+        _read_local.inode = inode
+    return conn
+
+
+def lookup_cards(cursor, names):
+    """Exact-key card lookup through the in-memory index when enabled, else SQLite"""
+    if card_index is not None:
+        return card_index.lookup(names)
+    return find_cards(cursor, names)
+
+
+def snapshot_version(cursor):
+    """The updates id of the snapshot lookups will read (the in-memory index's copy when enabled)"""
+    if card_index is not None:
+        return card_index.version[2]
+    return cursor.execute('SELECT MAX(id) FROM updates').fetchone()[0]
+
+
+def lookup_printings(cursor, printings):
+    """Exact (set, collector number) lookup through the in-memory index when enabled, else SQLite"""
+    if card_index is not None:
+        return card_index.lookup_printings(printings)
+    return find_printings(cursor, printings)
+
+
+# Fuzzy matching costs around a millisecond per name, so a long paste of junk
+# would otherwise run into the worker timeout. Past either limit the remaining
+# misses are reported as not found
+FUZZY_MAX_NAMES = int(os.environ.get('FUZZY_MAX_NAMES', '500'))
+FUZZY_BUDGET_MS = float(os.environ.get('FUZZY_BUDGET_MS', '2000'))
+
+# Typo-tolerant fallback index, built once per snapshot in each worker
+_fuzzy_lock = threading.Lock()
+_fuzzy = {'inode': None, 'index': None}
+
+
+def get_fuzzy_index():
+    """Return this worker's fuzzy index, rebuilding it after a snapshot swap"""
+    inode = os.stat(DB_PATH).st_ino
+    if _fuzzy['inode'] != inode:
+        with _fuzzy_lock:
+            if _fuzzy['inode'] != inode:
+                conn = open_read_only(DB_PATH)
+                try:
+                    _fuzzy['index'] = FuzzyIndex.load(conn)
+                finally:
+                    conn.close()
+                _fuzzy['inode'] = inode
+    return _fuzzy['index']
+
+
+def sort_group(cards):
+    """Sort one (rarity, color) group by name, non-foil first, dropping the sort key"""
+    cards.sort(key=lambda x: (x['sort_key'], x['foil']))
+    for card in cards:
+        del card['sort_key']
+
+
+def stream_results(groups, not_found, fuzzy_matches, suggestions, totals, timer):
+    """NDJSON lines for the streaming mode: misses, then each group as it is sorted, then totals"""
+    def line(message):
+        with timer.stage('serialize'):
+            return json.dumps(message, separators=(',', ':')) + '\n'
+    
+    yield line({'type': 'not_found', 'not_found': not_found,
+                'fuzzy_matches': fuzzy_matches, 'suggestions': suggestions})
+    for rarity, colors in groups.items():
+        for color in list(colors):
+            # Popped so each group can be freed once it has been sent
+            cards = colors.pop(color)
+            if cards:
+                with timer.stage('sort'):
+                    sort_group(cards)
+                yield line({'type': 'group', 'rarity': rarity, 'color': color, 'cards': cards})
+    yield line(dict(totals, type='done'))
 
 # HTML template with PROPER indentation
 HTML_TEMPLATE = '''<!DOCTYPE html>
@@ -100,6 +214,16 @@ HTML_TEMPLATE = '''<!DOCTYPE html>
             border-radius: 5px; 
             margin: 10px 0; 
         }
+        .not-found .suggestion { 
+            color: #666; 
+        }
+        .fuzzy-matches { 
+            color: #1565c0; 
+            background: #e3f2fd; 
+            padding: 10px; 
+            border-radius: 5px; 
+            margin: 10px 0; 
+        }
         /* Remove any lingering tooltips */
         #card-image-tooltip ~ #card-image-tooltip {
             display: none !important;
@@ -159,6 +283,12 @@ Plains"></textarea>
     </div>
 
     <script>
+// Lists at least this long are streamed as NDJSON and rendered group by group
+const STREAM_THRESHOLD = 2000;
+
+// Last JSON result and its ETag; resubmitting the same list comes back as a 304
+let lastResult = null;
+
 async function processList() {
     const cardText = document.getElementById('cardInput').value;
     if (!cardText.trim()) {
@@ -193,13 +323,30 @@ async function processList() {
         '</div>';
     
     try {
+        const stream = cardCount >= STREAM_THRESHOLD;
+        const headers = { 'Content-Type': 'application/json' };
+        if (!stream && lastResult) {
+            headers['If-None-Match'] = lastResult.etag;
+        }
         const response = await fetch('/process_list', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ cards: cardText })
+            headers: headers,
+            body: JSON.stringify({ cards: cardText, stream: stream })
         });
         
+        if (response.status === 304 && lastResult) {
+            displayResults(lastResult.result);
+            showMessage('✅ Same list as last time - ' + lastResult.result.total_cards + ' card entries (representing ' + lastResult.result.total_cards_input + ' total cards)', 'success');
+            return;
+        }
+        
         const contentType = response.headers.get('content-type');
+        // Errors still come back as plain JSON, so check what was actually sent
+        if (contentType && contentType.includes('application/x-ndjson')) {
+            const totals = await readStream(response);
+            showMessage('✅ Processed ' + totals.total_cards + ' card entries (representing ' + totals.total_cards_input + ' total cards) successfully!', 'success');
+            return;
+        }
         if (!contentType || !contentType.includes('application/json')) {
             const text = await response.text();
             console.error('Non-JSON response:', text.substring(0, 200));
@@ -213,6 +360,9 @@ async function processList() {
             return;
         }
         
+        const etag = response.headers.get('ETag');
+        lastResult = etag ? { etag: etag, result: result } : null;
+        
         displayResults(result);
         showMessage('✅ Processed ' + result.total_cards + ' card entries (representing ' + result.total_cards_input + ' total cards) successfully!', 'success');
         
@@ -225,17 +375,107 @@ async function processList() {
     }
 }
 
-function displayResults(result) {
-    let html = '<h2>Results (' + result.total_cards + ' card entries, ' + result.total_cards_input + ' total cards)</h2>';
+async function readStream(response) {
+    // One JSON message per line: not_found, then each group, then done with the totals
+    const results = document.getElementById('results');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let currentRarity = null;
+    let totals = null;
     
-    if (result.total_not_found > 0) {
-        html += '<div class="not-found"><h3>❌ Not Found (' + result.total_not_found + '):</h3><ul>';
+    const handle = (message) => {
+        if (message.type === 'not_found') {
+            results.innerHTML = '<h2 id="resultsSummary">Results (loading...)</h2>' + renderMisses(message);
+        } else if (message.type === 'group') {
+            let html = '';
+            if (message.rarity !== currentRarity) {
+                html += '<div class="group-header">' + message.rarity + '</div>';
+                currentRarity = message.rarity;
+            }
+            html += renderGroup(message.color, message.cards);
+            results.insertAdjacentHTML('beforeend', html);
+        } else if (message.type === 'done') {
+            totals = message;
+            document.getElementById('resultsSummary').textContent =
+                'Results (' + message.total_cards + ' card entries, ' + message.total_cards_input + ' total cards)';
+        }
+    };
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\\n');
+        buffered = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => handle(JSON.parse(line)));
+    }
+    if (buffered.trim()) handle(JSON.parse(buffered));
+    if (!totals) throw new Error('Response ended early');
+    
+    attachCardHover();
+    return totals;
+}
+
+function renderMisses(result) {
+    let html = '';
+    if (result.not_found.length > 0) {
+        html += '<div class="not-found"><h3>❌ Not Found (' + result.not_found.length + '):</h3><ul>';
+        const suggestions = result.suggestions || {};
         result.not_found.forEach(card => {
-            html += '<li>' + card + '</li>';
+            html += '<li>' + card;
+            if (suggestions[card]) {
+                html += ' <span class="suggestion">- did you mean ' +
+                    suggestions[card].map(s => s.name + ' (' + Math.round(s.score * 100) + '%)').join(', ') +
+                    '?</span>';
+            }
+            html += '</li>';
         });
         html += '</ul></div>';
     }
     
+    const fuzzyMatches = Object.entries(result.fuzzy_matches || {});
+    if (fuzzyMatches.length > 0) {
+        html += '<div class="fuzzy-matches"><h3>🔎 Corrected (' + fuzzyMatches.length + '):</h3><ul>';
+        fuzzyMatches.forEach(([input, match]) => {
+            html += '<li>' + input + ' → ' + match.name + ' (' + Math.round(match.score * 100) + '%)</li>';
+        });
+        html += '</ul></div>';
+    }
+    return html;
+}
+
+function renderGroup(color, cards) {
+    let html = '<div class="color-header">' + color + ' (' + cards.length + ' cards)</div>';
+    cards.forEach(card => {
+        html += '<div class="card-item">';
+        
+        // Add quantity display if > 1
+        if (card.quantity && card.quantity > 1) {
+            html += '<span class="card-quantity">' + card.quantity + '×</span> ';
+        } else {
+            html += '<span class="card-quantity"></span> ';
+        }
+        
+        html += '<strong>' + card.name + '</strong>';
+        html += '</div>';
+    });
+    return html;
+}
+
+function attachCardHover() {
+    // Enable card image hover for new results
+    setTimeout(() => {
+        if (typeof CardImageHover !== 'undefined') {
+            CardImageHover.attachToResults();
+        }
+    }, 100);
+}
+
+function displayResults(result) {
+    let html = '<h2>Results (' + result.total_cards + ' card entries, ' + result.total_cards_input + ' total cards)</h2>';
+    html += renderMisses(result);
+    
     const groups = result.grouped || {};
     const rarityOrder = ['Mythic/Rare', 'Common/Uncommon'];
     const colorOrder = ['White', 'Blue', 'Black', 'Red', 'Green', 
@@ -248,35 +488,14 @@ function displayResults(result) {
             
             for (const color of colorOrder) {
                 if (groups[rarity][color]) {
-                    const cards = groups[rarity][color];
-                    html += '<div class="color-header">' + color + ' (' + cards.length + ' cards)</div>';
-                    
-                    cards.forEach(card => {
-                        html += '<div class="card-item">';
-                        
-                        // Add quantity display if > 1
-                        if (card.quantity && card.quantity > 1) {
-                            html += '<span class="card-quantity">' + card.quantity + '×</span> ';
-                        } else {
-                            html += '<span class="card-quantity"></span> ';
-                        }
-                        
-                        html += '<strong>' + card.name + '</strong>';
-                        html += '</div>';
-                    });
+                    html += renderGroup(color, groups[rarity][color]);
                 }
             }
         }
     }
     
     document.getElementById('results').innerHTML = html;
-    
-    // Enable card image hover for new results
-    setTimeout(() => {
-        if (typeof CardImageHover !== 'undefined') {
-            CardImageHover.attachToResults();
-        }
-    }, 100);
+    attachCardHover();
 }
 
 function showMessage(text, type) {
@@ -651,14 +870,15 @@ document.addEventListener('DOMContentLoaded', () => {
 def index():
     return HTML_TEMPLATE
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics, summed over every worker, plus gauges for the snapshot on disk"""
+    body = metrics_registry.render(snapshot_gauges(DB_PATH))
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/process_list', methods=['POST'])
 def process_list():
-    
-
-    
-    import sys
-    print("🚀🚀🚀 PROCESS_LIST CALLED 🚀🚀🚀", flush=True)
-    sys.stdout.flush()
+    timer = g.timer
     
     try:
         data = request.get_json()
@@ -669,57 +889,39 @@ def process_list():
         if not card_text:
             return jsonify({'error': 'No cards provided'}), 400
         
-        print(f"Processing request")
-        
-        card_entries = []
         not_found = []
         
-        for line in card_text.strip().split('\n'):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-                
-            quantity_match = re.match(r'^(\d+)\s*x?\s*', line)
-            quantity = 1
-            if quantity_match:
-                quantity = int(quantity_match.group(1))
-                line = line[quantity_match.end():].strip()
-            
-            foil = False
-            foil_pattern = r'(?i)\s*(?:\(?foil\)?|\*)\s*$'
-            if re.search(foil_pattern, line):
-                foil = True
-                line = re.sub(foil_pattern, '', line).strip()
-            
-            line = line.strip()
-            if line:
-                card_entries.append({
-                    'name': line,
-                    'quantity': quantity,
-                    'foil': foil
-                })
-        
-        print(f"Processing {len(card_entries)} card entries")
-        
-        # DEBUGGING CODE
-        print(f"Card entries: {len(card_entries)}")
-
-
-
-        ########################################################
-        
-        # Get database connection (auto-builds/updates if needed)
+        # Read-only snapshot access; building and refreshing never happen on a request thread
         try:
-            conn = get_database_connection()
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = None
+            if card_index is not None:
+                card_index.ensure_started()
+            else:
+                cursor = get_read_connection().cursor()
+            version = snapshot_version(cursor)
         except Exception as e:
-            print(f"Database error: {e}")
+            logger.error(f"Database error: {e}")
             # Fallback option: you could implement Scryfall API fallback here
             return jsonify({
                 'error': 'Card database unavailable. Please try again later.'
             }), 500
         
+        # Plain text, MTGO, Arena or CSV - the parser detects which
+        with timer.stage('parse'):
+            entries_digest, card_entries = result_cache.entries_digest(card_text, parse_decklist)
+        
+        # The same list against the same snapshot gets the same bytes back
+        stream = bool(data.get('stream'))
+        cache_key = result_cache.key(entries_digest, version, stream,
+                                     choose_encoding(request.headers.get('Accept-Encoding')))
+        cached = result_cache.respond(cache_key)
+        if cached is not None:
+            timer.fields['cache'] = 'hit'
+            return cached
+        if card_entries is None:
+            with timer.stage('parse'):
+                card_entries = list(parse_decklist(card_text))
+        
         groups = {
             'Mythic/Rare': {},
             'Common/Uncommon': {}
@@ -737,15 +939,16 @@ def process_list():
         # Step 1: Build a lookup of all cards we need
         from collections import defaultdict
         
-        # First, collect all unique card names
+        timer.lap()
+        
+        # First, collect all unique card names, keyed by their canonical
+        # lookup key so spellings of the same card share one lookup
         unique_card_names = {}
         for entry in card_entries:
-            card_name = entry['name']
-            if card_name not in unique_card_names:
-                unique_card_names[card_name] = []
-            unique_card_names[card_name].append(entry)
-        
-        print(f"Unique card names: {len(unique_card_names)}")        
+            key = normalize_name(entry['name'])
+            if key not in unique_card_names:
+                unique_card_names[key] = []
+            unique_card_names[key].append(entry)
         
         # Step 2: Get ALL cards from database in ONE query 
         
@@ -756,52 +959,77 @@ def process_list():
         for name in all_names[:]:
             if ' // ' in name:
                 front_face = name.split(' // ')[0]
-                if front_face not in all_names:
+                if front_face not in unique_card_names:
                     all_names.append(front_face)
 
-        # Create placeholders for SQL IN clause
-        placeholders = ','.join(['?' for _ in all_names])
-
-        # Query for exact matches
-        cursor.execute(f"""
-            SELECT name, asciiName, colors, type, types, rarity, manaCost, hasFoil
-            FROM cards 
-            WHERE LOWER(name) IN ({placeholders})
-               OR LOWER(asciiName) IN ({placeholders})
-        """, [name.lower() for name in all_names] * 2)
-        
-        # Put all results into a lookup dictionary
-        card_db = {}
-        for row in cursor.fetchall():
-            card_db[row['name'].lower()] = row
-            card_db[row['asciiName'].lower()] = row
-        
-        # Step 3: Also get double-faced card matches
-        #dfc_names = [name for name in all_names_original if ' // ' not in name]
-        #if dfc_names:
-        #    dfc_placeholders = ','.join(['?' for _ in dfc_names])
-        #    cursor.execute(f"""
-        #        SELECT name, asciiName, colors, type, types, rarity, manaCost, hasFoil
-        #        FROM cards 
-        #        WHERE (name LIKE ? || ' //%' OR asciiName LIKE ? || ' //%')
-        #        AND LOWER(name) IN ({dfc_placeholders})
-        #    """, [name for name in dfc_names for _ in range(2)] + [name.lower() for name in dfc_names])
-        #    
-        #    for row in cursor.fetchall():
-        #        card_db[row['name'].lower()] = row
+        # Query for exact matches (one index probe per distinct name)
+        card_db = lookup_cards(cursor, all_names)
+        
+        # Entries naming a printing ("Lightning Bolt (M10) 146") resolve to that
+        # exact printing, one probe each
+        printing_pairs = {(entry['set'], entry['collector_number'])
+                          for entry in card_entries if entry['set'] and entry['collector_number']}
+        printing_db = lookup_printings(cursor, printing_pairs) if printing_pairs else {}
+        
+        # A misspelled name on a real printing still resolves through the printing
+        names_from_printings = {}
+        for key, entries in unique_card_names.items():
+            if key in card_db:
+                continue
+            for entry in entries:
+                printing = printing_db.get((entry['set'], entry['collector_number']))
+                if printing is not None:
+                    names_from_printings[key] = printing['name']
+                    break
+        if names_from_printings:
+            printing_rows = lookup_cards(cursor, names_from_printings.values())
+            for key, name in names_from_printings.items():
+                row = printing_rows.get(normalize_name(name))
+                if row is not None:
+                    card_db[key] = row
+        
+        # Step 3: Face names ("Delver of Secrets", "Fire") are matched by the
+        # face aliases in name_keys, so there is no LIKE query here.
+        # Names that still miss go through the local fuzzy index: close
+        # matches are resolved, the rest come back as suggestions.
+        fuzzy_matches = {}
+        suggestions = {}
+        resolved = {}
+        misses = [key for key in unique_card_names if key not in card_db]
+        if misses:
+            fuzzy = get_fuzzy_index()
+            deadline = time.perf_counter() + FUZZY_BUDGET_MS / 1000
+            for checked, key in enumerate(misses):
+                if checked >= FUZZY_MAX_NAMES or time.perf_counter() > deadline:
+                    timer.fields['fuzzy_skipped'] = len(misses) - checked
+                    if checked < FUZZY_MAX_NAMES:
+                        # Cut short by load rather than by the list: don't cache it
+                        result_cache.skip()
+                    break
+                input_name = unique_card_names[key][0]['name']
+                matches = fuzzy.match(key)
+                best = fuzzy.resolve(matches)
+                if best:
+                    resolved[key] = best
+                    fuzzy_matches[input_name] = {'name': best, 'score': matches[0][1]}
+                elif matches:
+                    suggestions[input_name] = [{'name': match, 'score': score} for match, score in matches]
+            
+            if resolved:
+                resolved_rows = lookup_cards(cursor, resolved.values())
+                for key, best in resolved.items():
+                    row = resolved_rows.get(normalize_name(best))
+                    if row is not None:
+                        card_db[key] = row
+        
+        timer.lap('lookup')
+        
+        # Per-entry detail only for sampled requests, and only at DEBUG
+        log_entries = timer.sampled and logger.isEnabledFor(logging.DEBUG)
         
         # Step 4: Process each card entry using our lookup
-        for card_name, entries in unique_card_names.items():
-            result = card_db.get(card_name.lower())
-            
-            if not result:
-                # Try ascii name
-                result = card_db.get(card_name.lower())
-            
-            if not result:
-                # Try without accents/special chars
-                simple_name = card_name.lower().replace('æ', 'ae').replace('ö', 'oe')
-                result = card_db.get(simple_name)
+        for key, entries in unique_card_names.items():
+            result = card_db.get(key)
             
             if not result:
                 # Card not found
@@ -817,94 +1045,30 @@ def process_list():
                 if len(parts) == 2 and parts[0] == parts[1]:
                     clean_name = parts[0]
                     # Check if we already have this card in our lookup
-                    if clean_name.lower() in card_db:
-                        result = card_db[clean_name.lower()]
-                        print(f"  Replaced self-meld '{db_name}' with '{result['name']}'")
+                    if normalize_name(clean_name) in card_db:
+                        result = card_db[normalize_name(clean_name)]
+                        logger.debug(f"Replaced self-meld '{db_name}' with '{result['name']}'")
             
             # Process all entries with this card name (handles multiples like 4x)
             for entry in entries:
-                print(f"  Matched '{entry['name']}' -> '{result['name']}' (types: {result['types']})")
+                if log_entries:
+                    logger.debug(f"Matched '{entry['name']}' -> '{result['name']}' ({result['type']})")
                 
-                try:
-                    colors = json.loads(result['colors']) if result['colors'] else []
-                except:
-                    colors = []
-                    
-                try:
-                    types = json.loads(result['types']) if result['types'] else []
-                except:
-                    types = []
+                # Classification is precomputed per card at build time
+                color_group = result['color_group']
+                rarity_group = result['rarity_group']
+                has_foil = result['hasFoil'] == 1
                 
-                rarity = result['rarity'].lower() if result['rarity'] else ''
-                if rarity in ['mythic', 'rare']:
-                    rarity_group = 'Mythic/Rare'
-                else:
-                    rarity_group = 'Common/Uncommon'
-                
-                # Color group logic (keep your existing code here)
-                color_group = 'Unknown'
-                display_name = result['name']
-                is_double_faced = ' // ' in display_name
-                
-                # Check mana cost for colors
-                mana_colors = set()
-                mana_cost = result['manaCost'] or ''
-                if mana_cost:
-                    for symbol in ['W', 'U', 'B', 'R', 'G']:
-                        if f'{{{symbol}}}' in mana_cost:
-                            mana_colors.add(symbol)
-                
-                all_colors = set(colors) | mana_colors
-                type_str = result['type'] or ''
-                
-                if is_double_faced and ' // ' in type_str:
-                    front_type = type_str.split(' // ')[0]
-                else:
-                    front_type = type_str
-                    
-                # Lands WITHOUT colors (basic lands, etc.)
-                # BUT: If it's a double-faced card where front is NOT a land, don't put in Land group
-                if 'Land' in types and len(all_colors) == 0:
-                    # Check if this is actually a land (not a double-faced card with land back)
-                    if is_double_faced:
-                        # Check if the FRONT face is a land
-                        front_type = type_str.split(' // ')[0] if ' // ' in type_str else type_str
-                        if 'Land' in front_type:
-                            color_group = 'Land'
-                        else:
-                            # Double-faced card with non-land front, land back - group by front
-                            pass  # Will be handled by normal color logic below
-                    else:
-                        # Regular land
-                        color_group = 'Land'
-                
-                if color_group == 'Unknown':
-                    special_types = ["Token", "Emblem", "Scheme", "Conspiracy", 
-                                   "Phenomenon", "Vanguard", "Hero"]
-                    if any(special_type in front_type for special_type in special_types):
-                        is_regular_card = any(regular_type in front_type for regular_type in 
-                                             ["Creature", "Planeswalker", "Instant", "Sorcery", 
-                                              "Enchantment", "Artifact", "Land", "Battle"])
-                        if not is_regular_card:
-                            color_group = 'Special Cards'
-                
-                if color_group == 'Unknown':
-                    front_is_artifact = 'Artifact' in front_type
-                    if front_is_artifact and len(all_colors) == 0:
-                        color_group = 'Artifact'
-                    elif len(all_colors) == 1:
-                        color_map = {'W': 'White', 'U': 'Blue', 'B': 'Black', 'R': 'Red', 'G': 'Green'}
-                        color_group = color_map.get(list(all_colors)[0], 'Unknown')
-                    elif len(all_colors) >= 2:
-                        color_group = 'Multicolor'
-                    elif len(all_colors) == 0:
-                        color_group = 'Colorless'
-                    else:
-                        color_group = 'Unknown'
+                # An exact printing overrides the canonical printing's rarity and finishes
+                printing = printing_db.get((entry['set'], entry['collector_number']))
+                if printing is not None and printing['name'] == result['name']:
+                    rarity_group = rarity_group_for(printing['rarity'])
+                    finishes = (printing['finishes'] or '').split(',')
+                    has_foil = 'foil' in finishes or 'etched' in finishes
                 
                 display_name = result['name']
                 if entry['foil']:
-                    if result['hasFoil'] == 1:
+                    if has_foil:
                         display_name = f"{result['name']} (FOIL)"
                     else:
                         display_name = f"{result['name']} (FOIL*)"
@@ -917,76 +1081,94 @@ def process_list():
                     'rarity_group': rarity_group,
                     'foil': entry['foil'],
                     'quantity': entry['quantity'],
-                    'sort_key': result['name'].lower()
+                    'sort_key': result['sort_key']
                 }
                 
                 groups[rarity_group][color_group].append(card_entry)
         
-        conn.close()
+        total_cards_input = sum(entry['quantity'] for entry in card_entries)
+        total_cards_found = sum(len(cards) for rarity in groups.values() 
+                               for cards in rarity.values())
+        timer.lap('classify')
+        timer.fields.update(entries=len(card_entries), unique=len(unique_card_names),
+                            found=total_cards_found, not_found=len(not_found),
+                            fuzzy=sum(len(unique_card_names[key]) for key in resolved if key in card_db),
+                            stream=stream, cache='miss')
+        
+        if stream:
+            # Opt-in NDJSON: groups go out one at a time instead of as one document
+            totals = {
+                'total_cards': total_cards_found,
+                'total_cards_input': total_cards_input,
+                'total_not_found': len(not_found)
+            }
+            return Response(stream_results(groups, not_found, fuzzy_matches, suggestions, totals, timer),
+                            mimetype='application/x-ndjson',
+                            headers={'X-Accel-Buffering': 'no'})
         
-        # FIXED: Proper sorting logic
+        # Sort by name (alphabetical), then by foil (non-foil first)
         for rarity in groups:
             for color in groups[rarity]:
-                # Sort by name (alphabetical), then by foil (non-foil first)
-                groups[rarity][color].sort(key=lambda x: (x['sort_key'], x['foil']))
-                for card in groups[rarity][color]:
-                    if 'sort_key' in card:
-                        del card['sort_key']
+                sort_group(groups[rarity][color])
         
         for rarity in list(groups.keys()):
             for color in list(groups[rarity].keys()):
                 if not groups[rarity][color]:
                     del groups[rarity][color]
-        
-        total_cards_input = sum(entry['quantity'] for entry in card_entries)
-        total_cards_found = sum(len(cards) for rarity in groups.values() 
-                               for cards in rarity.values())
+        timer.lap('sort')
         
         response = {
             'grouped': groups,
             'not_found': not_found,
             'total_cards': total_cards_found,
             'total_cards_input': total_cards_input,
-            'total_not_found': len(not_found)
+            'total_not_found': len(not_found),
+            'fuzzy_matches': fuzzy_matches,
+            'suggestions': suggestions
         }
         
-        print(f"Processed {total_cards_found} of {total_cards_input} cards, {len(not_found)} not found")
-        # Compress the response to avoid size limits
+        # ResponseCompressor compresses this on the way out
         response_json = jsonify(response)
-        response_data = response_json.get_data()
-        compressed = gzip.compress(response_data)
-        compressed_response = make_response(compressed)
-        compressed_response.headers['Content-Encoding'] = 'gzip'
-        compressed_response.headers['Content-Type'] = 'application/json'
-        
-        print(f"Response size: {len(response_data)} bytes")
-        print(f"Number of cards in response: {total_cards_found}")
-        print(f"Number of groups: {len(groups)}")
-        
-        # TEMPORARY - bypass compression to test
-        # return response_json
-                
-        return compressed_response
+        timer.lap('serialize')
+        
+        return response_json
         
     except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error: {str(e)}")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 # This runs when Render STARTS the app (not when users visit)
-print("🚀 Render is starting up...")
-
-# Build database if it doesn't exist
-db_path = 'data/mtg_cards.sqlite'
-if not os.path.exists(db_path):
-    print("📦 No database found. Building now...")
-    from database_builder import MTGDatabase
-    db = MTGDatabase()
-    db.build_or_update()
-    print("✅ Database ready!")
+logger.info("🚀 Render is starting up...")
+
+# Build database if it doesn't exist (one worker builds, the others wait for it)
+if not os.path.exists(DB_PATH):
+    with snapshot_lock(DB_PATH):
+        db = MTGDatabase(DB_PATH)
+        if not os.path.exists(DB_PATH):
+            logger.info("📦 No database found. Building now...")
+            db.build_or_update()
+            logger.info("✅ Database ready!")
+        else:
+            db.initialize()
+        db.conn.close()
 else:
-    print("✅ Database already exists!")
+    logger.info("✅ Database already exists!")
+    # Bring older snapshots up to the current schema before requests open it read-only.
+    # A refresh holds the lock for its whole download and build, and a worker
+    # waiting on it could miss gunicorn's boot timeout; the refresh migrates first anyway
+    try:
+        with snapshot_lock(DB_PATH, blocking=False):
+            db = MTGDatabase(DB_PATH)
+            db.initialize()
+            db.conn.close()
+    except SnapshotBusy:
+        logger.info("Snapshot refresh in progress elsewhere, skipping startup migration")
+
+# Keep the snapshot fresh in the background; requests pick up the swap on their own.
+# Started by each process's first request rather than here, so every gunicorn
+# worker runs one even when the app is imported before forking (--preload)
+refresher = Refresher(DB_PATH)
+app.before_request(refresher.start)
 
 if __name__ == '__main__':
     os.makedirs('data', exist_ok=True)
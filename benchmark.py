@@ -0,0 +1,701 @@
+# benchmark.py - Timing harness for the card lookup path, the request pipeline and the builder
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from card_parser import detect_format, parse_decklist
+from database_builder import (CARD_COLORS, CARD_TYPES, MTGDatabase, build_worker_count, color_mask,
+                              find_cards, find_printings, mask_names, type_mask)
+
+
+def build_synthetic_db(db_path, card_count):
+    """Fill a fresh database with card_count synthetic cards"""
+    db = MTGDatabase(db_path)
+    db.initialize()
+
+    batch = []
+    printings = []
+    for i in range(card_count):
+        name = f"Synthetic Card {i}"
+        # One printing each, so "Name (SYN) i" resolves through the printings table
+        printings.append(('syn', str(i), name, 'common', 'nonfoil,foil', f'syn-{i}', '2024-01-01'))
+        color = random.choice('WUBRG')
+        colors = color_mask([color])
+        types = type_mask(['Creature'])
+        row = (name, name, colors, 'Creature — Elf', types,
+               'common', '{%s}' % color, 1, 'normal', '2024-01-01T00:00:00')
+        batch.append(row + db.classify_card(name, colors, types, 'common', '{%s}' % color,
+                                            'Creature — Elf') + (None,))
+        if len(batch) >= 1000:
+            db.insert_batch(batch)
+            db.insert_printings(printings)
+            batch = []
+            printings = []
+    if batch:
+        db.insert_batch(batch)
+        db.insert_printings(printings)
+
+    db.build_name_keys()
+    db.create_indexes()
+    # Mark it fresh so the app never tries to download a real snapshot
+    db.cursor.execute('INSERT INTO updates (last_bulk_update, card_count) VALUES (?, ?)',
+                      (time.strftime('%Y-%m-%dT%H:%M:%S'), card_count))
+    db.conn.commit()
+    return db
+
+
+def time_call(fn, repeat):
+    """Best-of-repeat wall time for fn() in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def legacy_lookup(cursor, names):
+    """The LOWER(name) IN (...) query process_list used before name_keys"""
+    placeholders = ','.join(['?' for _ in names])
+    cursor.execute(f"""
+        SELECT name, asciiName, type, types, manaCost, hasFoil
+        FROM cards
+        WHERE LOWER(name) IN ({placeholders})
+           OR LOWER(asciiName) IN ({placeholders})
+    """, [name.lower() for name in names] * 2)
+    return cursor.fetchall()
+
+
+def bench_lookup(args):
+    """Lookup time for a fixed-size list as the cards table grows"""
+    print(f"{'cards':>10} {'name_keys ms':>14} {'LOWER() ms':>12}")
+    for card_count in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = build_synthetic_db(os.path.join(tmp, 'bench.sqlite'), card_count)
+            cursor = db.conn.cursor()
+            names = [f"synthetic card {random.randrange(card_count)}" for _ in range(args.names)]
+
+            indexed = time_call(lambda: find_cards(cursor, names), args.repeat)
+            legacy = time_call(lambda: legacy_lookup(cursor, names), args.repeat)
+            print(f"{card_count:>10} {indexed:>14.3f} {legacy:>12.3f}")
+            db.conn.close()
+
+
+def bench_throughput(args):
+    """Lookup throughput (names/sec) as the number of unique names (or printings) in one request grows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = build_synthetic_db(os.path.join(tmp, 'bench.sqlite'), args.cards)
+        cursor = db.conn.cursor()
+
+        print(f"{'names':>8} {'ms':>10} {'names/sec':>12} {'printings ms':>13} {'printings/sec':>14}")
+        for count in args.names:
+            picked = random.sample(range(args.cards), count)
+            names = [f"synthetic card {i}" for i in picked]
+            printings = [('syn', str(i)) for i in picked]
+            elapsed = time_call(lambda: find_cards(cursor, names), args.repeat)
+            by_printing = time_call(lambda: find_printings(cursor, printings), args.repeat)
+            print(f"{count:>8} {elapsed:>10.2f} {count / (elapsed / 1000):>12,.0f} "
+                  f"{by_printing:>13.2f} {count / (by_printing / 1000):>14,.0f}")
+        db.conn.close()
+
+
+def synthetic_decklist(lines, format):
+    """A pasted list of the given size in 'text', 'arena' or 'csv' form"""
+    rows = []
+    if format == 'csv':
+        rows.append('"Count","Tradelist Count","Name","Edition","Condition","Language","Foil","Collector Number"')
+    for i in range(lines):
+        name = f"Synthetic Card {random.randrange(100000)}"
+        quantity = random.randint(1, 4)
+        foil = random.random() < 0.2
+        if format == 'csv':
+            rows.append(f'"{quantity}","0","{name}","m10","Near Mint","English","{"foil" if foil else ""}","{i}"')
+        elif format == 'arena':
+            rows.append(f"{quantity} {name} (M10) {i}" + (" *F*" if foil else ""))
+        else:
+            rows.append(f"{quantity}x {name}" + (" (foil)" if foil else ""))
+    return '\n'.join(rows)
+
+
+def bench_parse(args):
+    """Decklist parser speed per input format"""
+    print(f"{'format':>8} {'lines':>8} {'ms':>10} {'lines/sec':>12}")
+    for format in ('text', 'arena', 'csv'):
+        text = synthetic_decklist(args.lines, format)
+        elapsed = time_call(lambda: list(parse_decklist(text)), args.repeat)
+        print(f"{format:>8} {args.lines:>8} {elapsed:>10.1f} {args.lines / (elapsed / 1000):>12,.0f}")
+
+
+def bench_request(args):
+    """End-to-end /process_list latency, SQL lookups vs the in-memory card index"""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'data'))
+        build_synthetic_db(os.path.join(tmp, 'data', 'mtg_cards.sqlite'), args.cards).conn.close()
+        os.chdir(tmp)
+
+        # Time the lookups, not the result cache (both modes share a cache key), the refresher or request logs
+        os.environ['RESULT_CACHE'] = 'off'
+        os.environ['REFRESH_INTERVAL_HOURS'] = '0'
+        os.environ['LOG_LEVEL'] = 'WARNING'
+        os.environ['LOG_SAMPLE_RATE'] = '0'
+        os.environ['LOG_SLOW_MS'] = 'inf'
+        os.environ['METRICS_DIR'] = os.path.join(tmp, 'metrics')
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as app_module
+            from card_index import CardIndex
+            index = CardIndex('data/mtg_cards.sqlite')
+            index.ensure_started()
+        client = app_module.app.test_client()
+
+        print(f"{'lines':>8} {'mode':>6} {'median ms':>10} {'best ms':>9}")
+        for lines in args.lines:
+            # Every fifth line names its printing, as Arena and MTGO exports do
+            rows = []
+            for row in range(lines):
+                card = random.randrange(args.cards)
+                printing = f" (SYN) {card}" if row % 5 == 0 else ''
+                rows.append(f"{random.randint(1, 4)}x Synthetic Card {card}{printing}")
+            text = '\n'.join(rows)
+            for mode, card_index in (('sql', None), ('index', index)):
+                app_module.card_index = card_index
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        response = client.post('/process_list', json={'cards': text})
+                    timings.append((time.perf_counter() - start) * 1000)
+                    assert response.status_code == 200, response.status_code
+                timings.sort()
+                print(f"{lines:>8} {mode:>6} {timings[len(timings) // 2]:>10.2f} {timings[0]:>9.2f}")
+
+
+# Share of fixture cards per layout; the rest are plain single-faced cards
+FIXTURE_LAYOUTS = (('land', 0.10), ('transform', 0.08), ('modal_dfc', 0.04), ('adventure', 0.05),
+                   ('split', 0.04), ('token', 0.06))
+FIXTURE_SETS = ('lea', 'm10', 'dmu', 'neo', 'mh2', 'woe')
+
+
+def synthetic_bulk_card(rng, i, layout):
+    """One Scryfall-style bulk entry of the given layout"""
+    colors = rng.sample('WUBRG', rng.choice((0, 1, 1, 1, 2)))
+    cost = ''.join('{%s}' % color for color in colors) or '{2}'
+    if layout == 'land':
+        card = {'name': f"Fixture Land {i}", 'type_line': 'Land', 'colors': [], 'mana_cost': ''}
+    elif layout in ('transform', 'modal_dfc'):
+        front, back = f"Fixture Front {i}", f"Fixture Back {i}"
+        card = {'name': f"{front} // {back}", 'type_line': 'Creature — Human // Creature — Werewolf',
+                'card_faces': [
+                    {'name': front, 'type_line': 'Creature — Human', 'colors': colors, 'mana_cost': cost},
+                    {'name': back, 'type_line': 'Creature — Werewolf', 'colors': colors, 'mana_cost': ''},
+                ]}
+    elif layout == 'adventure':
+        creature, spell = f"Fixture Giant {i}", f"Fixture Stomp {i}"
+        card = {'name': f"{creature} // {spell}", 'type_line': 'Creature — Giant // Instant — Adventure',
+                'colors': ['R'], 'mana_cost': '{2}{R} // {1}{R}',
+                'card_faces': [{'name': creature, 'colors': ['R']}, {'name': spell, 'colors': ['R', 'G']}]}
+    elif layout == 'split':
+        card = {'name': f"Fixture Fire {i} // Fixture Ice {i}", 'type_line': 'Instant // Instant',
+                'colors': ['U', 'R'], 'mana_cost': '{1}{R} // {1}{U}'}
+    elif layout == 'token':
+        card = {'name': f"Fixture Token {i}", 'type_line': 'Token Creature — Elf', 'colors': ['G']}
+    else:
+        card = {'name': f"Fixture Card {i}", 'colors': colors, 'mana_cost': cost,
+                'type_line': rng.choice(('Creature — Elf', 'Instant', 'Sorcery', 'Enchantment',
+                                         'Artifact Creature — Golem', 'Planeswalker — Jace'))}
+    card['layout'] = layout
+    return card
+
+
+def write_synthetic_bulk(path, card_count, reprint_rate=0.5, seed=0):
+    """Write a bulk JSON array of card_count cards (plus reprints), returning the card names"""
+    rng = random.Random(seed)
+    names = []
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        first = True
+        for i in range(card_count):
+            roll = rng.random()
+            layout = 'normal'
+            for candidate, share in FIXTURE_LAYOUTS:
+                if roll < share:
+                    layout = candidate
+                    break
+                roll -= share
+            card = synthetic_bulk_card(rng, i, layout)
+            names.append(card['name'])
+
+            printings = 1
+            while printings < 4 and rng.random() < reprint_rate:
+                printings += 1
+            for printing in range(printings):
+                finishes = rng.choice((['nonfoil'], ['nonfoil', 'foil'], ['foil']))
+                card.update(id=f"fixture-{i}-{printing}", set=FIXTURE_SETS[printing], collector_number=str(i),
+                            rarity=rng.choice(('common', 'uncommon', 'rare', 'mythic')),
+                            released_at=f"{2000 + printing * 5}-01-01", finishes=finishes,
+                            foil='foil' in finishes, nonfoil='nonfoil' in finishes)
+                f.write(('' if first else ',\n') + json.dumps(card))
+                first = False
+        f.write('\n]\n')
+    return names
+
+
+def build_fixture_db(db_path, bulk_path, workers=0):
+    """Build a snapshot from a fixture bulk file with process_bulk_data; returns seconds taken"""
+    # process_bulk_data deletes its input, so it gets a copy
+    work_path = bulk_path + '.work'
+    shutil.copyfile(bulk_path, work_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = MTGDatabase(db_path, workers=workers)
+        db.initialize()
+        start = time.perf_counter()
+        db.process_bulk_data(work_path)
+        elapsed = time.perf_counter() - start
+    db.conn.close()
+    return elapsed
+
+
+# Bump when fixture_decklist changes what it generates; baselines from older lists aren't comparable
+FIXTURE_LIST_VERSION = 2
+
+
+def fixture_decklist(rng, names, lines, printings=(), miss_rate=0.02):
+    """A pasted list of fixture cards: mostly bare names, some with set codes, exact printings
+    ("Name (SET) 12", from printings: (name, set code, collector number)), foils and misses"""
+    rows = []
+    for i in range(lines):
+        roll = rng.random()
+        if roll < miss_rate:
+            rows.append(f"{rng.randint(1, 4)} Missing Card {i}")
+            continue
+        if printings and roll < 0.12:
+            name, set_code, number = rng.choice(printings)
+            rows.append(f"{rng.randint(1, 4)} {name.split(' // ')[0]} ({set_code.upper()}) {number}")
+            continue
+        name = rng.choice(names).split(' // ')[0]
+        if roll < 0.2:
+            rows.append(f"{rng.randint(1, 4)} {name} ({rng.choice(FIXTURE_SETS[:2]).upper()})")
+        elif roll < 0.3:
+            rows.append(f"{rng.randint(1, 4)}x {name} (foil)")
+        else:
+            rows.append(f"{rng.randint(1, 4)} {name}")
+    return '\n'.join(rows)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def traced_peak_mb(fn):
+    """Peak Python heap allocated while fn() runs, in MB"""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run_suite(args, tmp):
+    """Build the fixture and time every stage the suite covers; returns the results dict"""
+    bulk_path = os.path.join(tmp, 'bulk.json')
+    names = write_synthetic_bulk(bulk_path, args.cards, seed=args.seed)
+    printings = sum(1 for line in open(bulk_path, encoding='utf-8') if line.startswith('{'))
+    results = {'cards': args.cards, 'printings': printings, 'list_version': FIXTURE_LIST_VERSION,
+               'build': {}, 'requests': {}}
+
+    db_path = os.path.join(tmp, 'data', 'mtg_cards.sqlite')
+    os.makedirs(os.path.dirname(db_path))
+    timings = sorted(build_fixture_db(db_path + '.bench', bulk_path) for _ in range(args.build_runs))
+    os.remove(db_path + '.bench')
+    results['build'] = {
+        'median_s': round(timings[len(timings) // 2], 3),
+        'cards_per_s': round(printings / timings[len(timings) // 2]),
+        'peak_mb': traced_peak_mb(lambda: build_fixture_db(db_path, bulk_path)),
+    }
+    print(f"build: {printings} printings, median {results['build']['median_s']:.2f}s, "
+          f"{results['build']['cards_per_s']:,} cards/s, peak {results['build']['peak_mb']} MB")
+
+    # Measure the pipeline itself: no result cache, no refresher, no request logs
+    os.environ['RESULT_CACHE'] = 'off'
+    os.environ['REFRESH_INTERVAL_HOURS'] = '0'
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    os.environ['LOG_SAMPLE_RATE'] = '0'
+    os.environ['LOG_SLOW_MS'] = 'inf'
+    os.environ['METRICS_DIR'] = os.path.join(tmp, 'metrics')
+    os.chdir(tmp)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+    client = app_module.app.test_client()
+
+    def post(text):
+        response = client.post('/process_list', json={'cards': text})
+        assert response.status_code == 200, response.status_code
+        response.get_data()
+        response.close()
+
+    conn = sqlite3.connect(db_path)
+    snapshot_printings = conn.execute(
+        'SELECT name, set_code, collector_number FROM printings ORDER BY set_code, collector_number').fetchall()
+    conn.close()
+
+    rng = random.Random(args.seed)
+    print(f"{'lines':>8} {'runs':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'lines/s':>10} {'peak MB':>8}")
+    for lines in args.lines:
+        text = fixture_decklist(rng, names, lines, snapshot_printings)
+        # Warm-up run, also used to size the run count to the time budget
+        start = time.perf_counter()
+        post(text)
+        runs = max(args.min_runs, min(args.runs, int(args.budget / (time.perf_counter() - start))))
+
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            post(text)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        p50 = percentile(samples, 50)
+        results['requests'][str(lines)] = stats = {
+            'runs': runs,
+            'p50_ms': round(p50, 2),
+            'p90_ms': round(percentile(samples, 90), 2),
+            'p99_ms': round(percentile(samples, 99), 2),
+            'lines_per_s': round(lines / (p50 / 1000)),
+            'peak_mb': traced_peak_mb(lambda: post(text)),
+        }
+        print(f"{lines:>8} {runs:>5} {stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f} "
+              f"{stats['lines_per_s']:>10,} {stats['peak_mb']:>8}")
+    return results
+
+
+# Per-result metrics checked against the baseline, and whether higher is better
+REGRESSION_CHECKS = {
+    'build': (('median_s', False), ('peak_mb', False)),
+    'request': (('p50_ms', False), ('p90_ms', False), ('lines_per_s', True), ('peak_mb', False)),
+}
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """Print every change past threshold; returns the list of regressions"""
+    pairs = [('build', 'build', results['build'], baseline.get('build', {}))]
+    for lines, stats in results['requests'].items():
+        pairs.append((f"{lines} lines", 'request', stats, baseline.get('requests', {}).get(lines, {})))
+
+    regressions = []
+    for label, kind, current, previous in pairs:
+        for metric, higher_is_better in REGRESSION_CHECKS[kind]:
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            if abs(change) >= threshold:
+                status = 'REGRESSION' if worse > 0 else 'improved'
+                print(f"  {label:>12} {metric:<12} {old:>12,} -> {new:>12,} ({change:+.0%}) {status}")
+                if worse > 0:
+                    regressions.append((label, metric))
+    return regressions
+
+
+def bench_suite(args):
+    """Fixture build plus /process_list at several list sizes, checked against a JSON baseline"""
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        try:
+            results = run_suite(args, tmp)
+        finally:
+            os.chdir(cwd)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if any(baseline.get(field) != results[field] for field in ('cards', 'printings', 'list_version')):
+        sys.exit(f"Baseline {args.baseline} was recorded with a different fixture; rerun with --update-baseline")
+    print(f"Against {args.baseline} (threshold {args.threshold:.0%}):")
+    regressions = compare_to_baseline(results, baseline, args.threshold)
+    if regressions:
+        sys.exit(f"{len(regressions)} regression(s) past {args.threshold:.0%}")
+    print("No regressions")
+
+
+def snapshot_digest(db_path):
+    """sha256 over every row a build writes, leaving out the build's own timestamp"""
+    conn = sqlite3.connect(db_path)
+    digest = hashlib.sha256()
+    for table in ('cards', 'printings', 'name_keys'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})') if row[1] != 'last_updated']
+        for row in conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY rowid'):
+            digest.update(repr(row).encode('utf-8'))
+    conn.close()
+    return digest.hexdigest()[:16]
+
+
+def bench_normalize(args):
+    """process_bulk_data with cards normalized in-process vs across a pool of processes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        bulk_path = os.path.join(tmp, 'bulk.json')
+        write_synthetic_bulk(bulk_path, args.cards, seed=args.seed)
+        print(f"{args.cards:,} cards, {os.path.getsize(bulk_path) / 1e6:.0f} MB fixture, "
+              f"{os.cpu_count()} CPU(s)")
+
+        # Main CPU is this process alone: the serial part left once the pool has enough cores
+        print(f"{'workers':>8} {'best s':>8} {'median s':>9} {'speedup':>8} {'main CPU s':>11} {'digest':>17}")
+        digests = set()
+        baseline = None
+        for workers in [build_worker_count(setting) for setting in args.workers]:
+            db_path = os.path.join(tmp, f'workers-{workers}.sqlite')
+            timings = []
+            cpu = []
+            for _ in range(args.repeat):
+                cpu_start = time.process_time()
+                timings.append(build_fixture_db(db_path, bulk_path, workers=workers))
+                cpu.append(time.process_time() - cpu_start)
+            timings.sort()
+            median = timings[len(timings) // 2]
+            baseline = baseline or median
+            digest = snapshot_digest(db_path)
+            digests.add(digest)
+            print(f"{workers:>8} {timings[0]:>8.2f} {median:>9.2f} {baseline / median:>7.2f}x "
+                  f"{min(cpu):>11.2f} {digest:>17}")
+
+    if len(digests) > 1:
+        sys.exit("Snapshots differ between worker counts")
+    print("Snapshots identical")
+
+
+# Cards the fixture layouts don't produce, aimed at the edges of the grouping rules
+PARITY_CASES = (
+    {'name': "Parity Spell // Parity Land", 'layout': 'modal_dfc', 'type_line': 'Instant // Land',
+     'card_faces': [{'name': "Parity Spell", 'type_line': 'Instant', 'colors': ['U'], 'mana_cost': '{1}{U}'},
+                    {'name': "Parity Land", 'type_line': 'Land', 'colors': [], 'mana_cost': ''}]},
+    {'name': "Parity Relic // Parity Vault", 'layout': 'modal_dfc', 'type_line': 'Artifact // Land',
+     'card_faces': [{'name': "Parity Relic", 'type_line': 'Artifact', 'colors': [], 'mana_cost': '{3}'},
+                    {'name': "Parity Vault", 'type_line': 'Land', 'colors': [], 'mana_cost': ''}]},
+    {'name': "Parity Meadow // Parity Grove", 'layout': 'modal_dfc', 'type_line': 'Land // Land',
+     'card_faces': [{'name': "Parity Meadow", 'type_line': 'Land', 'colors': []},
+                    {'name': "Parity Grove", 'type_line': 'Land', 'colors': []}]},
+    {'name': "Parity Arbor", 'type_line': 'Land Creature — Forest Dryad', 'colors': ['G'], 'mana_cost': ''},
+    {'name': "Parity Emblem", 'type_line': 'Emblem — Jace', 'colors': []},
+    {'name': "Parity Scheme", 'type_line': 'Ongoing Scheme', 'colors': []},
+    {'name': "Parity Avatar", 'type_line': 'Vanguard', 'colors': []},
+    {'name': "Parity Treasure", 'type_line': 'Token Artifact — Treasure', 'colors': []},
+    {'name': "Parity Idol", 'type_line': 'Artifact', 'colors': [], 'mana_cost': '{2}{R}'},
+    {'name': "Parity Golem", 'type_line': 'Artifact Creature — Golem', 'colors': [], 'mana_cost': '{4}'},
+    {'name': "Parity Eldrazi", 'type_line': 'Creature — Eldrazi', 'colors': [], 'mana_cost': '{5}{C}'},
+    {'name': "Parity Hybrid", 'type_line': 'Creature — Elf', 'colors': ['W', 'U'], 'mana_cost': '{W/U}'},
+    {'name': "Parity Charm", 'type_line': 'Instant', 'colors': ['B', 'R', 'G'], 'mana_cost': '{B}{R}{G}'},
+    {'name': "Parity Blank", 'rarity': ''},
+    {'name': "Parity Mythic", 'type_line': 'Sorcery', 'colors': ['R'], 'mana_cost': '{R}', 'rarity': 'Mythic'},
+    {'name': "Parity Special", 'type_line': 'Sorcery', 'colors': ['R'], 'mana_cost': '{R}', 'rarity': 'special'},
+)
+
+
+def baseline_classification(name, colors, types, rarity, mana_cost, type_line):
+    """process_list's grouping rules as they ran per entry before classify_card moved them to the
+    builder; colors and types are the lists the snapshot used to store"""
+    rarity = rarity.lower() if rarity else ''
+    if rarity in ['mythic', 'rare']:
+        rarity_group = 'Mythic/Rare'
+    else:
+        rarity_group = 'Common/Uncommon'
+
+    color_group = 'Unknown'
+    is_double_faced = ' // ' in name
+
+    mana_colors = set()
+    mana_cost = mana_cost or ''
+    if mana_cost:
+        for symbol in ['W', 'U', 'B', 'R', 'G']:
+            if f'{{{symbol}}}' in mana_cost:
+                mana_colors.add(symbol)
+
+    all_colors = set(colors) | mana_colors
+    type_str = type_line or ''
+
+    if is_double_faced and ' // ' in type_str:
+        front_type = type_str.split(' // ')[0]
+    else:
+        front_type = type_str
+
+    if 'Land' in types and len(all_colors) == 0:
+        if is_double_faced:
+            front_type = type_str.split(' // ')[0] if ' // ' in type_str else type_str
+            if 'Land' in front_type:
+                color_group = 'Land'
+        else:
+            color_group = 'Land'
+
+    if color_group == 'Unknown':
+        special_types = ["Token", "Emblem", "Scheme", "Conspiracy",
+                         "Phenomenon", "Vanguard", "Hero"]
+        if any(special_type in front_type for special_type in special_types):
+            is_regular_card = any(regular_type in front_type for regular_type in
+                                  ["Creature", "Planeswalker", "Instant", "Sorcery",
+                                   "Enchantment", "Artifact", "Land", "Battle"])
+            if not is_regular_card:
+                color_group = 'Special Cards'
+
+    if color_group == 'Unknown':
+        front_is_artifact = 'Artifact' in front_type
+        if front_is_artifact and len(all_colors) == 0:
+            color_group = 'Artifact'
+        elif len(all_colors) == 1:
+            color_map = {'W': 'White', 'U': 'Blue', 'B': 'Black', 'R': 'Red', 'G': 'Green'}
+            color_group = color_map.get(list(all_colors)[0], 'Unknown')
+        elif len(all_colors) >= 2:
+            color_group = 'Multicolor'
+        else:
+            color_group = 'Colorless'
+
+    return (color_group, rarity_group, name.lower())
+
+
+def check_parity(args):
+    """classify_card against the per-request grouping rules it replaced, over every fixture layout"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        db = MTGDatabase(':memory:')
+    db.build_time = '2024-01-01T00:00:00'
+    rng = random.Random(args.seed)
+    cards = []
+    for layout in [layout for layout, _ in FIXTURE_LAYOUTS] + ['normal']:
+        for i in range(args.cards):
+            card = synthetic_bulk_card(rng, i, layout)
+            card['rarity'] = rng.choice(('common', 'uncommon', 'rare', 'mythic'))
+            cards.append(card)
+    cards.extend(dict(card, layout=card.get('layout', 'normal'), rarity=card.get('rarity', 'rare'))
+                 for card in PARITY_CASES)
+
+    checked = {}
+    mismatches = []
+    for card in cards:
+        card_entry = db.normalize_card(card)[0]
+        name, _, colors, type_line, types, rarity, mana_cost = card_entry[:7]
+        expected = baseline_classification(name, mask_names(colors, CARD_COLORS), mask_names(types, CARD_TYPES),
+                                           rarity, mana_cost, type_line)
+        actual = card_entry[-3:]
+        checked[card['layout']] = checked.get(card['layout'], 0) + 1
+        if actual != expected:
+            mismatches.append((name, expected, actual))
+
+    print(' '.join(f"{layout}: {count}" for layout, count in checked.items()))
+    for name, expected, actual in mismatches[:20]:
+        print(f"  {name}: expected {expected}, classify_card gave {actual}")
+    if mismatches:
+        sys.exit(f"{len(mismatches)} of {len(cards)} cards classified differently")
+    print(f"All {len(cards)} cards classified the same")
+
+
+# Pasted lists with the format they should be detected as and the
+# (name, quantity, set, collector number) entries they should parse to
+PARSER_CASES = (
+    ("4 Lightning Bolt\n4xShock\n2 x Opt\n1 Xenagos, the Reveler", 'text',
+     [('Lightning Bolt', 4, None, None), ('Shock', 4, None, None), ('Opt', 2, None, None),
+      ('Xenagos, the Reveler', 1, None, None)]),
+    ("²x Lightning Bolt\nShock", 'text', [('²x Lightning Bolt', 1, None, None), ('Shock', 1, None, None)]),
+    ("Deck\n4 Lightning Bolt (M10) 146\n\nSideboard\n2 Duress (M19) 94", 'arena',
+     [('Lightning Bolt', 4, 'm10', '146'), ('Duress', 2, 'm19', '94')]),
+    ("Count,Name,Edition,Collector Number\n4,Lightning Bolt,m10,146\n²,Shock,m19,156", 'csv',
+     [('Lightning Bolt', 4, 'm10', '146'), ('Shock', 1, 'm19', '156')]),
+    ("\nCount,Name\n4,Lightning Bolt", 'csv', [('Lightning Bolt', 4, None, None)]),
+    ("# Exported from Moxfield\nCount,Name\n4,Lightning Bolt", 'csv', [('Lightning Bolt', 4, None, None)]),
+    ("Qty\tName\n3\tOpt", 'csv', [('Opt', 3, None, None)]),
+)
+
+
+def check_parser(args):
+    """Format detection and parsing of known pastes (text, MTGO, Arena and CSV exports)"""
+    failures = 0
+    for text, expected_format, expected in PARSER_CASES:
+        detected = detect_format(text.splitlines())
+        entries = [(entry['name'], entry['quantity'], entry['set'], entry['collector_number'])
+                   for entry in parse_decklist(text)]
+        if detected != expected_format or entries != expected:
+            failures += 1
+            print(f"  {text!r}: detected {detected}, parsed {entries}")
+    if failures:
+        sys.exit(f"{failures} of {len(PARSER_CASES)} pastes parsed differently")
+    print(f"All {len(PARSER_CASES)} pastes parsed as expected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MTG List Sorter benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    lookup = subparsers.add_parser('lookup', help=bench_lookup.__doc__)
+    lookup.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    lookup.add_argument('--names', type=int, default=100)
+    lookup.add_argument('--repeat', type=int, default=5)
+    lookup.set_defaults(func=bench_lookup)
+
+    throughput = subparsers.add_parser('throughput', help=bench_throughput.__doc__)
+    throughput.add_argument('--cards', type=int, default=100000)
+    throughput.add_argument('--names', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    throughput.add_argument('--repeat', type=int, default=3)
+    throughput.set_defaults(func=bench_throughput)
+
+    parse = subparsers.add_parser('parse', help=bench_parse.__doc__)
+    parse.add_argument('--lines', type=int, default=100000)
+    parse.add_argument('--repeat', type=int, default=3)
+    parse.set_defaults(func=bench_parse)
+
+    request = subparsers.add_parser('request', help=bench_request.__doc__)
+    request.add_argument('--cards', type=int, default=30000)
+    request.add_argument('--lines', type=int, nargs='+', default=[10, 10000])
+    request.add_argument('--repeat', type=int, default=7)
+    request.set_defaults(func=bench_request)
+
+    normalize = subparsers.add_parser('normalize', help=bench_normalize.__doc__)
+    normalize.add_argument('--cards', type=int, default=100000, help="unique cards in the fixture")
+    normalize.add_argument('--workers', nargs='+', default=['0', '2', 'auto'],
+                           help="BUILD_WORKERS values to compare; the first is the speedup baseline")
+    normalize.add_argument('--repeat', type=int, default=3)
+    normalize.add_argument('--seed', type=int, default=0)
+    normalize.set_defaults(func=bench_normalize)
+
+    parser_check = subparsers.add_parser('parser', help=check_parser.__doc__)
+    parser_check.set_defaults(func=check_parser)
+
+    parity = subparsers.add_parser('parity', help=check_parity.__doc__)
+    parity.add_argument('--cards', type=int, default=500, help="fixture cards per layout")
+    parity.add_argument('--seed', type=int, default=0)
+    parity.set_defaults(func=check_parity)
+
+    suite = subparsers.add_parser('suite', help=bench_suite.__doc__)
+    suite.add_argument('--cards', type=int, default=20000, help="unique cards in the fixture")
+    suite.add_argument('--lines', type=int, nargs='+', default=[10, 1000, 10000, 100000])
+    suite.add_argument('--runs', type=int, default=30, help="most timed runs per list size")
+    suite.add_argument('--min-runs', type=int, default=3)
+    suite.add_argument('--budget', type=float, default=10, help="seconds of timed runs per list size")
+    suite.add_argument('--build-runs', type=int, default=3)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--baseline', default='bench_baseline.json')
+    suite.add_argument('--threshold', type=float, default=0.25,
+                       help="relative change that counts as a regression (default 0.25)")
+    suite.add_argument('--update-baseline', action='store_true')
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    random.seed(0)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# card_index.py - Per-worker in-memory copy of the card lookup tables
+import os
+import sqlite3
+import threading
+import time
+
+from database_builder import normalize_name, open_read_only
+
+
+class CardIndex:
+    """Maps lookup keys to pre-classified card rows so requests need no SQL.
+
+    Built once per worker process from the snapshot and rebuilt in a
+    background thread when the file or its updates row changes.
+    """
+
+    def __init__(self, db_path='data/mtg_cards.sqlite', check_interval=30):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.keys = {}
+        self.printings = {}
+        self.version = None
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def snapshot_version(self):
+        """Identify the snapshot on disk: the file (swaps change inode/mtime) plus its last update"""
+        stat = os.stat(self.db_path)
+        conn = open_read_only(self.db_path)
+        try:
+            last_update = conn.execute('SELECT MAX(id) FROM updates').fetchone()[0]
+        finally:
+            conn.close()
+        return (stat.st_ino, stat.st_mtime_ns, last_update)
+
+    def load(self):
+        """Read the snapshot into a fresh key map and swap it in"""
+        version = self.snapshot_version()
+        start = time.perf_counter()
+
+        conn = open_read_only(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            cards = {}
+            for row in conn.execute('''
+                SELECT name, asciiName, type, types, manaCost, hasFoil,
+                       color_group, rarity_group, sort_key
+                FROM cards
+            '''):
+                cards[row['name']] = row
+
+            # Same precedence as find_cards: lowest priority number wins
+            keys = {}
+            for key, name in conn.execute(
+                    'SELECT key, name FROM name_keys ORDER BY priority DESC, name DESC'):
+                keys[key] = cards[name]
+
+            printings = {}
+            for row in conn.execute('''
+                SELECT set_code, collector_number, name, rarity, finishes, scryfall_id
+                FROM printings
+            '''):
+                printings[(row[0], row[1])] = row
+        finally:
+            conn.close()
+
+        # Plain reference swaps, so readers never see a half-built map
+        self.keys = keys
+        self.printings = printings
+        self.version = version
+        self.loaded_at = time.time()
+        print(f"Card index loaded: {len(keys)} keys, {len(cards)} cards, {len(printings)} printings "
+              f"in {time.perf_counter() - start:.2f}s (pid {os.getpid()})")
+
+    def reload_if_changed(self):
+        """Reload when the snapshot on disk is not the one in memory"""
+        try:
+            if self.snapshot_version() != self.version:
+                self.load()
+        except (OSError, sqlite3.Error) as e:
+            # Keep serving the copy we have
+            print(f"Card index reload failed: {e}")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.reload_if_changed()
+
+    def ensure_started(self):
+        """Load and start the watcher once per process, on first use so it runs after any fork"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.load()
+            watcher = threading.Thread(target=self._watch, name='card-index-watcher', daemon=True)
+            watcher.start()
+            self._pid = os.getpid()
+
+    def lookup_printings(self, printings):
+        """Same contract as find_printings: {(set, number): row} for the printings that exist"""
+        self.ensure_started()
+        known = self.printings
+        found = {}
+        for set_code, number in printings:
+            pair = (set_code.lower(), number)
+            row = known.get(pair)
+            if row is not None:
+                found[pair] = row
+        return found
+
+    def lookup(self, names):
+        """Same contract as find_cards: {lookup key: row} for the names that matched"""
+        self.ensure_started()
+        keys = self.keys
+        found = {}
+        for name in names:
+            key = normalize_name(name)
+            row = keys.get(key)
+            if row is not None:
+                found[key] = row
+        return found
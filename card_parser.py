@@ -0,0 +1,183 @@
+# card_parser.py - Decklist / collection parser for plain text, MTGO, Arena and CSV exports
+import csv
+import re
+
+# Line grammar, compiled once
+# "4 Name", "4x Name", "4xName", "4 x Name"; a lone X needs a space after it so "4 Xenagos" keeps its X
+_QUANTITY = re.compile(r'(\d+)(?:[xX]\s*|\s+[xX]\s+|\s*)')
+_SIDEBOARD_PREFIX = re.compile(r'SB:\s*', re.IGNORECASE)
+_FOIL_SUFFIX = re.compile(r'(?:\s*\(foil\)|(?:^|\s+)foil|\s*\*[FE]\*|\s*\*)$', re.IGNORECASE)
+# "(M10) 146", "[M10]", "(PLST) LRW-123"
+_PRINTING_SUFFIX = re.compile(r'\s+[(\[]([A-Za-z0-9]{2,6})[)\]](?:\s+([A-Za-z0-9★\-]+))?$')
+# Longest foil marker ("  (foil)"), so suffix searches only scan the tail of a line
+_FOIL_WINDOW = 12
+_SECTION_HEADER = re.compile(
+    r'(?://\s*)?(deck|main ?deck|main|sideboard|commander|companion|maybeboard|'
+    r'considering|tokens|about)\s*:?\s*(?:\(\d+\))?$', re.IGNORECASE)
+
+# CSV header names used by Moxfield, Deckbox, Archidekt and friends
+_CSV_COLUMNS = {
+    'name': ('name', 'card name', 'card'),
+    'quantity': ('count', 'quantity', 'qty', 'amount'),
+    'set': ('set code', 'edition code', 'set', 'edition'),
+    'collector_number': ('collector number', 'card number', 'number', 'collector_number'),
+    'foil': ('foil', 'finish', 'printing'),
+    'section': ('board', 'section', 'category'),
+}
+_FOIL_VALUES = {'foil', 'etched', 'true', 'yes', '1', 'y'}
+
+# Lines sampled to decide which format a paste is in
+DETECT_LINES = 20
+
+
+def detect_format(lines):
+    """Guess 'csv', 'arena' or 'text' (plain / MTGO) from the first few meaningful lines"""
+    sample = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            sample.append(line)
+            if len(sample) >= DETECT_LINES:
+                break
+    if not sample:
+        return 'text'
+
+    header = sample[0].lower()
+    if (',' in header or '\t' in header or ';' in header) and any(
+            column in (cell.strip(' "\'') for cell in re.split(r'[,\t;]', header))
+            for column in _CSV_COLUMNS['name']):
+        return 'csv'
+
+    for line in sample:
+        if _PRINTING_SUFFIX.search(line) or line.lower() in ('deck', 'commander', 'companion'):
+            return 'arena'
+    return 'text'
+
+
+def _entry(name, quantity=1, foil=False, set_code=None, collector_number=None, section='main'):
+    return {
+        'name': name,
+        'quantity': quantity,
+        'foil': foil,
+        'set': set_code.lower() if set_code else None,
+        'collector_number': collector_number or None,
+        'section': section,
+    }
+
+
+def _strip_foil(line):
+    """Split a trailing foil marker off a line: (foil?, rest)"""
+    if line and line[-1] in '*)lL':
+        match = _FOIL_SUFFIX.search(line, max(0, len(line) - _FOIL_WINDOW))
+        if match:
+            return True, line[:match.start()]
+    return False, line
+
+
+def parse_lines(lines):
+    """Parse plain text, MTGO and Arena lines into entries"""
+    section = 'main'
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+
+        line_section = section
+        quantity = 1
+        match = _QUANTITY.match(line)
+        if match:
+            quantity = int(match.group(1))
+            line = line[match.end():]
+        else:
+            # Section headers ("Sideboard", "Commander", "// Sideboard")
+            header = _SECTION_HEADER.match(line)
+            if header:
+                section = header.group(1).lower().replace(' ', '')
+                section = 'main' if section in ('deck', 'maindeck') else section
+                continue
+            if line.startswith('//') or section == 'about':
+                continue
+
+            prefix = _SIDEBOARD_PREFIX.match(line)
+            if prefix:
+                line_section = 'sideboard'
+                line = line[prefix.end():]
+                match = _QUANTITY.match(line)
+                if match:
+                    quantity = int(match.group(1))
+                    line = line[match.end():]
+
+        # Foil markers can sit before or after the printing ("Name (M10) 146 *F*")
+        foil, line = _strip_foil(line)
+
+        set_code = collector_number = None
+        # The set is the last bracketed group; anchor there instead of scanning
+        start = max(line.rfind(' ('), line.rfind(' ['))
+        if start > 0:
+            match = _PRINTING_SUFFIX.match(line, start)
+            if match:
+                set_code, collector_number = match.group(1), match.group(2)
+                line = line[:start]
+                if not foil:
+                    foil, line = _strip_foil(line)
+
+        name = line.strip()
+        if name:
+            yield _entry(name, quantity, foil, set_code, collector_number, line_section)
+
+
+def parse_csv(lines):
+    """Parse a CSV/TSV export with a header row into entries"""
+    lines = iter(lines)
+    # The header is the first meaningful line, as detect_format sees it
+    header_line = ''
+    for line in lines:
+        if line.strip() and not line.strip().startswith('#'):
+            header_line = line
+            break
+    if '\t' in header_line:
+        dialect = '\t'
+    elif ';' in header_line and ',' not in header_line:
+        dialect = ';'
+    else:
+        dialect = ','
+    header = [cell.strip().lower() for cell in next(csv.reader([header_line], delimiter=dialect))]
+
+    columns = {}
+    for field, names in _CSV_COLUMNS.items():
+        for column_name in names:
+            if column_name in header:
+                columns[field] = header.index(column_name)
+                break
+    if 'name' not in columns:
+        return
+
+    def cell(row, field):
+        index = columns.get(field)
+        if index is None or index >= len(row):
+            return ''
+        return row[index].strip()
+
+    for row in csv.reader(lines, delimiter=dialect):
+        name = cell(row, 'name')
+        if not name:
+            continue
+        quantity = cell(row, 'quantity')
+        yield _entry(
+            name,
+            int(quantity) if quantity.isdecimal() else 1,
+            cell(row, 'foil').lower() in _FOIL_VALUES,
+            cell(row, 'set') or None,
+            cell(row, 'collector_number') or None,
+            cell(row, 'section').lower() or 'main',
+        )
+
+
+def parse_decklist(text, format=None):
+    """Stream entries (name, quantity, foil, set, collector_number, section) from a pasted list"""
+    lines = text.splitlines()
+    if format is None:
+        format = detect_format(lines)
+    if format == 'csv':
+        return parse_csv(lines)
+    return parse_lines(lines)
@@ -0,0 +1,168 @@
+# compression.py - One negotiated compression stage for every response
+import gzip
+import os
+import time
+import zlib
+
+from flask import request
+
+from instrumentation import current_timer
+
+try:
+    import brotli
+except ImportError:  # optional: gzip still works without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# Bodies smaller than this go out as-is; headers would eat the saving
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+
+# Levels tuned for on-the-fly compression of card JSON: past these, each step
+# costs far more time than it saves bytes (gzip 9 is ~7x slower than 6 for ~14%)
+COMPRESS_LEVELS = {
+    'br': int(os.environ.get('COMPRESS_BR_LEVEL', '4')),
+    'zstd': int(os.environ.get('COMPRESS_ZSTD_LEVEL', '3')),
+    'gzip': int(os.environ.get('COMPRESS_GZIP_LEVEL', '6')),
+}
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/css',
+                      'text/plain', 'application/javascript', 'text/javascript')
+
+
+def available_encodings():
+    """Encodings this process can produce, in server preference order"""
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def choose_encoding(accept_encoding, available=None):
+    """Pick the encoding for an Accept-Encoding header, or None for identity.
+
+    The client's q-values decide; ties go to the server's preference order.
+    """
+    available = available or available_encodings()
+    weights = {}
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            weights[coding.strip()] = q
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, level=None):
+    """Compress bytes with the named encoding at its configured level"""
+    level = COMPRESS_LEVELS[encoding] if level is None else level
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def compress_stream(chunks, encoding, level=None, timer=None):
+    """Compress a stream chunk by chunk, flushing after each so the client can decode it as it arrives"""
+    level = COMPRESS_LEVELS[encoding] if level is None else level
+    if encoding == 'br':
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=level)
+
+        def step(chunk):
+            return compressor.process(chunk) + compressor.flush()
+        finish = compressor.finish
+    elif encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+        def step(chunk):
+            return compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        finish = compressor.flush
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        def step(chunk):
+            return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    else:
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+    for chunk in chunks:
+        start = time.perf_counter()
+        body = step(_as_bytes(chunk))
+        if timer is not None:
+            timer.add('compress', (time.perf_counter() - start) * 1000)
+        yield body
+    yield finish()
+
+
+def _as_bytes(chunk):
+    return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+class ResponseCompressor:
+    """after_request hook that compresses eligible responses for the encoding the client accepts"""
+
+    def __init__(self, app=None, min_size=COMPRESS_MIN_SIZE):
+        self.min_size = min_size
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough
+                or response.status_code < 200 or response.status_code >= 300
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        if response.is_streamed:
+            # Size is unknown up front, so streams are always compressed when accepted
+            encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+            if encoding is not None:
+                response.response = compress_stream(response.response, encoding,
+                                                     timer=current_timer())
+                response.headers['Content-Encoding'] = encoding
+                response.headers.pop('Content-Length', None)
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        start = time.perf_counter()
+        body = compress(data, encoding)
+        timer = current_timer()
+        if timer is not None:
+            # Reported as its own stage, apart from the time the handler took
+            timer.add('compress', (time.perf_counter() - start) * 1000)
+            timer.fields.update(encoding=encoding, raw_bytes=len(data), sent_bytes=len(body))
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,16 +1,474 @@
 # database_builder.py
 import sqlite3
 import requests
+import codecs
 import gzip
+import hashlib
+import itertools
 import json
+import multiprocessing
 import os
+import queue
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from collections import deque
 from datetime import datetime, timedelta
+from urllib.request import pathname2url
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+# Read the bulk file in 1 MB pieces so memory stays flat however big the dump is
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Bulk-load profile for the shadow build: nothing is durable until the final
+# rename, so journaling and fsyncs are pure overhead
+BULK_LOAD_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA locking_mode = EXCLUSIVE',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -131072',  # 128 MB
+]
+
+# Names per lookup query; well under SQLite's bound-variable limit (999 on old builds)
+LOOKUP_CHUNK_SIZE = 500
+
+# Read-only connections map this much of the snapshot instead of copying pages
+READ_MMAP_SIZE = 256 * 1024 * 1024
+
+# Build straight from the download (BULK_STREAM=1, default) or save the dump to
+# data/bulk_data.json first, which lets an interrupted download resume (0)
+BULK_STREAM = os.environ.get('BULK_STREAM', '1') == '1'
+
+# Streaming builds hand work between stages in batches of this many cards, with
+# at most this many batches (or download chunks) waiting between two stages
+PIPELINE_BATCH_SIZE = 500
+PIPELINE_QUEUE_SIZE = 8
+
+# Processes that normalize cards during a build: 0 (default) keeps it in the
+# building process, 'auto' uses one per core. The snapshot is the same either way
+BUILD_WORKERS = os.environ.get('BUILD_WORKERS', '0')
+
+# Next to the snapshot: the bulk item a build found no card changes in. The
+# snapshot is left untouched then, so this is where the next check learns it
+# has already seen that dump
+BULK_SEEN_SUFFIX = '.bulk.json'
+
+# Point this at a local stand-in server to exercise the download without hitting Scryfall
+SCRYFALL_API = os.environ.get('SCRYFALL_API', 'https://api.scryfall.com')
+
+
+def iter_json_array(chunks):
+    """Yield the items of a top-level JSON array one at a time from an iterable of text chunks"""
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    exhausted = False
+    
+    def more():
+        nonlocal buf, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            return False
+        # Drop what we've already consumed before growing the buffer
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+    
+    # Find the opening bracket
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n\ufeff':
+            pos += 1
+        if pos < len(buf):
+            break
+        if not more():
+            return
+    if buf[pos] != '[':
+        raise ValueError("Bulk data is not a JSON array")
+    pos += 1
+    
+    while True:
+        # Skip whitespace and separators between items
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(buf):
+            if not more():
+                raise ValueError("Bulk data ended before the closing ']'")
+            continue
+        if buf[pos] == ']':
+            return
+        
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Item is split across chunks - read more and try again
+            if not more():
+                raise
+            continue
+        
+        # A scalar touching the end of the buffer may be cut short
+        if end == len(buf) and not exhausted and not isinstance(item, (dict, list)):
+            if more():
+                continue
+        
+        pos = end
+        yield item
+
+
+
+def _decode_chunks(chunks, encoding='utf-8'):
+    """Decode byte chunks to text, holding back a character split across two chunks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def _batched(items, size):
+    """Group an iterable into lists of up to size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class BulkFormatError(ValueError):
+    """The bulk file isn't laid out one card per line, so it can't be split up unparsed"""
+
+
+def _iter_item_lines(chunks):
+    """Yield the raw text of each item of a JSON array written one item per line.
+    
+    Scryfall writes its bulk files this way. A raw newline can't occur inside
+    a JSON string, so each line is exactly one item; any other layout raises
+    BulkFormatError.
+    """
+    state = 'start'
+    tail = ''
+    for chunk in itertools.chain(chunks, ['\n']):
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            line = line.strip().lstrip('\ufeff')
+            if not line:
+                continue
+            if state == 'start' and line == '[':
+                state = 'items'
+            elif state == 'items' and line == ']':
+                state = 'end'
+            elif state == 'items' and line[0] == '{' and line[-1] in '},':
+                yield line[:-1] if line[-1] == ',' else line
+            else:
+                raise BulkFormatError(f"Bulk data is not one card per line near {line[:60]!r}")
+    if state != 'end':
+        raise BulkFormatError("Bulk data ended before the closing ']'")
+
+
+_PIPELINE_DONE = object()
+
+
+class BuildPipeline:
+    """Stages on their own threads, each feeding the next through a bounded queue.
+    
+    A full queue blocks the stage feeding it, so a slow writer holds the download
+    back instead of the dump piling up in memory. The first error stops every
+    stage and is raised again by consume().
+    """
+    
+    def __init__(self, queue_size=PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+        self.error = None
+        self.threads = []
+        self.stats = []
+    
+    def _track(self, name, unit):
+        stats = {'name': name, 'unit': unit, 'items': 0, 'wait': 0.0,
+                 'start': time.perf_counter(), 'end': None}
+        self.stats.append(stats)
+        return stats
+    
+    def _put(self, q, item, stats):
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        stats['wait'] += time.perf_counter() - start
+    
+    def _drain(self, q, stats):
+        while True:
+            start = time.perf_counter()
+            item = _PIPELINE_DONE
+            while not self.stopped.is_set():
+                try:
+                    item = q.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    pass
+            stats['wait'] += time.perf_counter() - start
+            if item is _PIPELINE_DONE:
+                return
+            yield item
+    
+    def stage(self, name, transform, inbox=None, unit='items', size=len):
+        """Run transform(items from inbox) on a thread; returns the queue its output goes to.
+        
+        A first stage has no inbox and transform gets None. size(item) is what an
+        output item counts for in the throughput log.
+        """
+        outbox = queue.Queue(self.queue_size)
+        stats = self._track(name, unit)
+        
+        def run():
+            try:
+                items = self._drain(inbox, stats) if inbox is not None else None
+                for item in transform(items):
+                    stats['items'] += size(item)
+                    self._put(outbox, item, stats)
+            except BaseException as e:
+                self.stop(e)
+            finally:
+                stats['end'] = time.perf_counter()
+                self._put(outbox, _PIPELINE_DONE, stats)
+        
+        thread = threading.Thread(target=run, name=f'build-{name}', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return outbox
+    
+    def consume(self, name, inbox, unit='items', size=len):
+        """Iterate the last queue on the calling thread, raising the first stage error"""
+        stats = self._track(name, unit)
+        for item in self._drain(inbox, stats):
+            yield item
+            stats['items'] += size(item)
+        stats['end'] = time.perf_counter()
+        if self.error is not None:
+            raise self.error
+    
+    def stop(self, error=None):
+        """Abort every stage; blocked puts and gets give up within a tenth of a second"""
+        if error is not None and self.error is None:
+            self.error = error
+        self.stopped.set()
+    
+    def finish(self):
+        """Wait for the stages to wind down and log how busy each one was"""
+        for thread in self.threads:
+            thread.join()
+        print("Pipeline throughput:")
+        for stats in self.stats:
+            wall = max((stats['end'] or time.perf_counter()) - stats['start'], 1e-9)
+            busy = max(wall - stats['wait'], 1e-9)
+            print(f"  {stats['name']:<10} {stats['items']:>12,.0f} {stats['unit']:<6} in {wall:6.1f}s, "
+                  f"busy {busy / wall:4.0%}, {stats['items'] / busy:>12,.0f} {stats['unit']}/s while busy")
+
+
+# Bump when normalize_name changes so existing snapshots rebuild their name_keys
+NAME_KEY_VERSION = 2
+
+# Characters NFKD leaves alone but people type (or paste) differently
+_NAME_FOLDS = str.maketrans({
+    'Æ': 'AE', 'æ': 'ae', 'Œ': 'OE', 'œ': 'oe', 'Ø': 'O', 'ø': 'o', 'ß': 'ss',
+    '\u2018': "'", '\u2019': "'", '\u201b': "'", '\u2032': "'", '`': "'", '\u00b4': "'",
+    '\u201c': '"', '\u201d': '"',
+    '\u2010': '-', '\u2011': '-', '\u2012': '-', '\u2013': '-', '\u2014': '-',
+})
+_FACE_SEPARATOR = re.compile(r'\s*//?\s*')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_name(name):
+    """Fold a card name to its canonical lookup key.
+    
+    Applied to every key the builder writes and every name a request looks
+    up, so matching is exact-key only: accents are stripped (NFKD),
+    ligatures and curly quotes folded, whitespace collapsed, and face
+    separators spaced as ' // ' ('Fire//Ice', 'Fire / Ice').
+    """
+    name = name.translate(_NAME_FOLDS)
+    if not name.isascii():
+        name = unicodedata.normalize('NFKD', name)
+        name = ''.join(c for c in name if not unicodedata.combining(c))
+    if '/' in name:
+        name = _FACE_SEPARATOR.sub(' // ', name)
+    return _WHITESPACE.sub(' ', name).strip().casefold()
+
+
+def find_cards(cursor, names, chunk_size=LOOKUP_CHUNK_SIZE):
+    """Look up cards by name, returning {lookup key: row} with one index probe per distinct key"""
+    keys = list(dict.fromkeys(normalize_name(name) for name in names))
+    found = {}
+    
+    # Chunked so any list size stays under SQLite's bound-variable limit
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        placeholders = ','.join(['?' for _ in chunk])
+        cursor.execute(f'''
+            SELECT k.key, c.name, c.asciiName, c.type, c.types, c.manaCost, c.hasFoil,
+                   c.color_group, c.rarity_group, c.sort_key
+            FROM name_keys k
+            JOIN cards c ON c.name = k.name
+            WHERE k.key IN ({placeholders})
+            ORDER BY k.priority DESC, k.name DESC
+        ''', chunk)
+        
+        # Exact names beat face aliases: the lowest priority number comes last and wins
+        for row in cursor.fetchall():
+            found[row[0]] = row
+    return found
+
+
+def rarity_group_for(rarity):
+    """The sorter's rarity bucket for a Scryfall rarity"""
+    if rarity and rarity.lower() in ['mythic', 'rare']:
+        return 'Mythic/Rare'
+    return 'Common/Uncommon'
+
+
+# cards.colors and cards.types are bitmasks over these, in this order
+CARD_COLORS = ('W', 'U', 'B', 'R', 'G')
+CARD_TYPES = ('Land', 'Creature', 'Artifact', 'Enchantment',
+              'Instant', 'Sorcery', 'Planeswalker', 'Battle',
+              'Token', 'Emblem', 'Scheme', 'Conspiracy',
+              'Phenomenon', 'Vanguard', 'Hero')
+COLOR_BITS = {color: 1 << i for i, color in enumerate(CARD_COLORS)}
+TYPE_BITS = {card_type: 1 << i for i, card_type in enumerate(CARD_TYPES)}
+
+
+# Columns a card's content_hash covers: everything but the timestamps
+CARD_CONTENT_COLUMNS = ('name', 'asciiName', 'colors', 'type', 'types', 'rarity', 'manaCost', 'hasFoil',
+                        'layout', 'color_group', 'rarity_group', 'sort_key', 'canonical_id')
+
+
+# Every updates column, in table order
+UPDATE_COLUMNS = ('id', 'last_bulk_update', 'card_count', 'bulk_updated_at', 'bulk_etag', 'bulk_size',
+                  'build_seconds', 'cards_inserted', 'cards_changed', 'cards_deleted')
+
+
+def content_hash(*values):
+    """Short digest of a card's CARD_CONTENT_COLUMNS values; equal rows hash equal in every build"""
+    return hashlib.sha256(repr(values).encode('utf-8')).hexdigest()[:16]
+
+
+def color_mask(colors):
+    """Pack color letters ('W', 'U', ...) into a bitmask"""
+    mask = 0
+    for color in colors:
+        mask |= COLOR_BITS.get(color, 0)
+    return mask
+
+
+def type_mask(types):
+    """Pack card type names ('Land', 'Creature', ...) into a bitmask"""
+    mask = 0
+    for card_type in types:
+        mask |= TYPE_BITS.get(card_type, 0)
+    return mask
+
+
+def mask_names(mask, names):
+    """Unpack a bitmask back into the names it covers, e.g. mask_names(3, CARD_COLORS) == ['W', 'U']"""
+    return [name for i, name in enumerate(names) if mask >> i & 1]
+
+
+def printing_rank(card_data):
+    """Sort key for choosing a card's canonical printing; the highest wins.
+    
+    Regular paper printings beat digital-only, promo and oversized ones, then
+    the most recent release wins, with set and collector number as a
+    tiebreak so the choice never depends on dump order.
+    """
+    regular = not (card_data.get('digital') or card_data.get('promo') or card_data.get('oversized'))
+    return (regular, card_data.get('released_at') or '',
+            card_data.get('set') or '', card_data.get('collector_number') or '')
+
+
+def printing_finishes(card_data):
+    """Finishes a printing comes in, e.g. 'nonfoil,foil'"""
+    finishes = card_data.get('finishes')
+    if finishes is None:
+        # Older dumps only carry the booleans
+        finishes = [finish for finish in ('nonfoil', 'foil') if card_data.get(finish)]
+    return ','.join(finishes)
+
+
+def find_printings(cursor, printings, chunk_size=LOOKUP_CHUNK_SIZE // 2):
+    """Look up exact printings by (set code, collector number), returning {(set, number): row}"""
+    pairs = list(dict.fromkeys((set_code.lower(), number) for set_code, number in printings))
+    found = {}
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        placeholders = ','.join(['(?, ?)' for _ in chunk])
+        cursor.execute(f'''
+            SELECT set_code, collector_number, name, rarity, finishes, scryfall_id
+            FROM printings
+            WHERE (set_code, collector_number) IN (VALUES {placeholders})
+        ''', [value for pair in chunk for value in pair])
+        for row in cursor.fetchall():
+            found[(row[0], row[1])] = row
+    return found
+
+
+def open_read_only(db_path, mmap_size=READ_MMAP_SIZE):
+    """Open a snapshot read-only (mode=ro) with mmap enabled; it can never write or migrate"""
+    uri = 'file:' + pathname2url(os.path.abspath(db_path)) + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    if os.uname().sysname == 'Darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def _read_chunks(f, size=READ_CHUNK_SIZE):
+    """Read a file object in fixed-size pieces"""
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
 
 class MTGDatabase:
-    def __init__(self, db_path='data/mtg_cards.sqlite'):
+    def __init__(self, db_path='data/mtg_cards.sqlite', api_url=SCRYFALL_API, workers=None):
         self.db_path = db_path
+        self.api_url = api_url.rstrip('/')
         self.conn = None
         self.cursor = None
+        # Bulk item metadata for the file being processed, recorded in updates
+        self.bulk_info = None
+        self.workers = build_worker_count(BUILD_WORKERS) if workers is None else workers
+        # One timestamp for every row of a build, so the output doesn't depend on timing
+        self.build_time = None
         
         print(f"DEBUG: Database will be at: {os.path.abspath(self.db_path)}")
         
@@ -24,20 +482,58 @@ class MTGDatabase:
         
         self.conn = sqlite3.connect(self.db_path)
         self.cursor = self.conn.cursor()
-        
-        # Create cards table with ONLY what we need
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cards (
+        self.create_schema()
+    
+    def create_cards_table(self, table='cards'):
+        """Create the cards table (or a same-shaped table under another name)"""
+        # Create cards table with ONLY what we need; colors and types are
+        # bitmasks over CARD_COLORS and CARD_TYPES
+        self.cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
                 name TEXT PRIMARY KEY,
                 asciiName TEXT,
-                colors TEXT,
+                colors INTEGER,
                 type TEXT,
-                types TEXT,
+                types INTEGER,
                 rarity TEXT,
                 manaCost TEXT,
                 hasFoil INTEGER,
                 layout TEXT,
-                last_updated TIMESTAMP
+                last_updated TIMESTAMP,
+                color_group TEXT,
+                rarity_group TEXT,
+                sort_key TEXT,
+                canonical_id TEXT,
+                content_hash TEXT
+            )
+        ''')
+    
+    def create_schema(self):
+        """Create tables on the current connection if they don't exist"""
+        self.create_cards_table()
+        
+        # Every printing in the dump, so "Name (SET) 123" resolves to its own
+        # rarity and finishes; cards.canonical_id points at the one bare names use
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS printings (
+                set_code TEXT NOT NULL,
+                collector_number TEXT NOT NULL,
+                name TEXT NOT NULL,
+                rarity TEXT,
+                finishes TEXT,
+                scryfall_id TEXT,
+                released_at TEXT
+            )
+        ''')
+        
+        # Normalized lookup keys (name, ascii name, face names) pointing at
+        # cards.name, so lookups are index probes instead of LOWER()/LIKE scans.
+        # priority: 0 name, 1 ascii name, 2 face name, 3 ascii face name
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS name_keys (
+                key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                priority INTEGER NOT NULL
             )
         ''')
         
@@ -46,11 +542,103 @@ class MTGDatabase:
             CREATE TABLE IF NOT EXISTS updates (
                 id INTEGER PRIMARY KEY,
                 last_bulk_update TIMESTAMP,
-                card_count INTEGER
+                card_count INTEGER,
+                bulk_updated_at TEXT,
+                bulk_etag TEXT,
+                bulk_size INTEGER,
+                build_seconds REAL,
+                cards_inserted INTEGER,
+                cards_changed INTEGER,
+                cards_deleted INTEGER
             )
         ''')
         
+        # Older snapshots predate the bulk metadata columns
+        self.cursor.execute('PRAGMA table_info(updates)')
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for column, column_type in [('bulk_updated_at', 'TEXT'),
+                                    ('bulk_etag', 'TEXT'),
+                                    ('bulk_size', 'INTEGER'),
+                                    ('build_seconds', 'REAL'),
+                                    ('cards_inserted', 'INTEGER'),
+                                    ('cards_changed', 'INTEGER'),
+                                    ('cards_deleted', 'INTEGER')]:
+            if column not in existing:
+                self.cursor.execute(f'ALTER TABLE updates ADD COLUMN {column} {column_type}')
+        
+        # ...and the precomputed classification columns
+        self.cursor.execute('PRAGMA table_info(cards)')
+        column_types = {row[1]: row[2] for row in self.cursor.fetchall()}
+        missing = [column for column in ('color_group', 'rarity_group', 'sort_key')
+                   if column not in column_types]
+        for column in missing:
+            self.cursor.execute(f'ALTER TABLE cards ADD COLUMN {column} TEXT')
+        if 'canonical_id' not in column_types:
+            self.cursor.execute('ALTER TABLE cards ADD COLUMN canonical_id TEXT')
+        if 'content_hash' not in column_types:
+            self.cursor.execute('ALTER TABLE cards ADD COLUMN content_hash TEXT')
+        # ...and colors/types as JSON text instead of bitmasks
+        repacked = column_types.get('colors') == 'TEXT'
+        if repacked:
+            self.migrate_bitmasks()
+        if missing:
+            self.backfill_classification()
+        
+        # ...and lookup keys from the current normalize_name
+        self.cursor.execute('PRAGMA user_version')
+        key_version = self.cursor.fetchone()[0]
+        self.cursor.execute('SELECT EXISTS (SELECT 1 FROM cards)')
+        has_cards = self.cursor.fetchone()[0]
+        if has_cards and key_version < NAME_KEY_VERSION:
+            print("Building lookup keys...")
+            self.build_name_keys()
+            self.create_indexes()
+        
         self.conn.commit()
+        if repacked:
+            # Give the space the JSON columns took back to the file
+            self.cursor.execute('VACUUM')
+    
+    def migrate_bitmasks(self):
+        """Rewrite a snapshot that stored colors/types as JSON text with the bitmask columns"""
+        print("Converting colors and types to bitmasks...")
+        
+        def json_list(text):
+            try:
+                return json.loads(text) if text else []
+            except ValueError:
+                return []
+        
+        # The old columns have TEXT affinity and would store the masks as
+        # strings, so the table is rebuilt rather than updated in place
+        columns = ('name, asciiName, colors, type, types, rarity, manaCost, hasFoil, layout, '
+                   'last_updated, color_group, rarity_group, sort_key, canonical_id')
+        self.create_cards_table('cards_bitmask')
+        self.cursor.execute(f'SELECT {columns} FROM cards')
+        rows = [(row[0], row[1], color_mask(json_list(row[2])), row[3],
+                 type_mask(json_list(row[4]))) + row[5:]
+                for row in self.cursor.fetchall()]
+        self.cursor.executemany(f'''
+            INSERT INTO cards_bitmask ({columns})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        self.cursor.execute('DROP TABLE cards')
+        self.cursor.execute('ALTER TABLE cards_bitmask RENAME TO cards')
+    
+    def backfill_classification(self):
+        """Fill the classification columns on a snapshot built before they existed"""
+        print("Backfilling card classification...")
+        self.cursor.execute('''
+            SELECT name, colors, types, rarity, manaCost, type
+            FROM cards WHERE color_group IS NULL
+        ''')
+        updates = []
+        for name, colors, types, rarity, mana_cost, type_line in self.cursor.fetchall():
+            updates.append(self.classify_card(name, colors or 0, types or 0, rarity, mana_cost,
+                                              type_line) + (name,))
+        self.cursor.executemany('''
+            UPDATE cards SET color_group = ?, rarity_group = ?, sort_key = ? WHERE name = ?
+        ''', updates)
         
     def needs_update(self):
         """Check if database needs updating (older than 7 days)"""
@@ -63,117 +651,582 @@ class MTGDatabase:
         last_update = datetime.fromisoformat(result[0])
         return datetime.now() - last_update > timedelta(days=7)
     
-    def download_bulk_data(self):
-        """Download Scryfall bulk data"""
+    def last_bulk_info(self):
+        """Return the metadata of the last bulk item checked against this snapshot: the one a
+        no-op build saw, if any, else the one the snapshot was built from"""
+        self.cursor.execute('''
+            SELECT last_bulk_update, bulk_updated_at, bulk_etag, bulk_size
+            FROM updates ORDER BY id DESC LIMIT 1
+        ''')
+        result = self.cursor.fetchone()
+        if not result:
+            return {'updated_at': None, 'etag': None, 'size': None}
+        try:
+            with open(self.db_path + BULK_SEEN_SUFFIX) as f:
+                seen = json.load(f)
+            # Only valid for the snapshot it was checked against; a newer build records its own
+            if seen.get('snapshot') == result[0]:
+                return {'updated_at': seen.get('updated_at'), 'etag': seen.get('etag'), 'size': seen.get('size')}
+        except (OSError, ValueError):
+            pass
+        return {'updated_at': result[1], 'etag': result[2], 'size': result[3]}
+    
+    def save_bulk_seen(self):
+        """Remember the bulk item just found to hold no card changes, so the next check skips it"""
+        self.cursor.execute('SELECT last_bulk_update FROM updates ORDER BY id DESC LIMIT 1')
+        result = self.cursor.fetchone()
+        bulk_info = self.bulk_info or {}
+        seen = {'snapshot': result[0] if result else None, 'updated_at': bulk_info.get('updated_at'),
+                'etag': bulk_info.get('etag'), 'size': bulk_info.get('size')}
+        path = self.db_path + BULK_SEEN_SUFFIX
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(seen, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            # Only costs a repeat download next time
+            print(f"Could not record the bulk data checked: {e}")
+    
+    def fetch_bulk_item(self):
+        """Scryfall's default_cards bulk item, or None when the last build already used it"""
         print("Fetching Scryfall bulk data info...")
         
         # Get bulk data information
-        response = requests.get('https://api.scryfall.com/bulk-data')
+        response = requests.get(f'{self.api_url}/bulk-data', timeout=30)
+        response.raise_for_status()
         bulk_data = response.json()
         
         # Find the default cards endpoint
         for item in bulk_data['data']:
             if item['type'] == 'default_cards':
-                download_url = item['download_uri']
-                print(f"Downloading from: {download_url}")
-                
-                # Download the JSON file (it's not actually gzipped)
-                response = requests.get(download_url, stream=True)
-                
-                # Save as regular JSON file
-                temp_path = 'data/bulk_data.json'
-                with open(temp_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                
-                return temp_path
+                break
+        else:
+            raise Exception("Could not find default cards bulk data")
         
-        raise Exception("Could not find default cards bulk data")
+        last = self.last_bulk_info()
+        if last['updated_at'] and last['updated_at'] == item.get('updated_at') \
+                and last['size'] == item.get('size'):
+            print(f"Bulk data unchanged since {last['updated_at']}, skipping download")
+            return None
+        return item
+    
+    def update_snapshot(self):
+        """Fetch and build whatever Scryfall published since the last build; True if a snapshot was swapped in
+        (False when nothing new was published or none of its cards changed)"""
+        if BULK_STREAM:
+            return self.stream_bulk_data()
+        json_path = self.download_bulk_data()
+        if json_path is None:
+            return False
+        return self.process_bulk_data(json_path)
+    
+    def stream_bulk_data(self):
+        """Build a new snapshot while the bulk file downloads; False when nothing new was published
+        or none of its cards changed.
+        
+        No copy of the dump touches the disk. An interrupted transfer fails the
+        build (the live snapshot stays) and the next attempt starts over.
+        """
+        item = self.fetch_bulk_item()
+        if item is None:
+            return False
+        
+        last = self.last_bulk_info()
+        headers = {'If-None-Match': last['etag']} if last['etag'] else {}
+        print(f"Streaming from: {item['download_uri']}")
+        response = requests.get(item['download_uri'], stream=True, headers=headers, timeout=60)
+        try:
+            if response.status_code == 304:
+                print("Bulk data not modified (ETag match), skipping download")
+                return False
+            response.raise_for_status()
+            
+            self.bulk_info = {
+                'updated_at': item.get('updated_at'),
+                'etag': response.headers.get('ETag'),
+                'size': item.get('size'),
+            }
+            print("Processing bulk data...")
+            return self.build_snapshot(
+                lambda: self.load_cards_pipelined(response.iter_content(chunk_size=65536)))
+        except BulkFormatError as e:
+            # The transfer is spent; fetch it again and parse it the general way
+            print(f"{e}; streaming again with normalizing in this process")
+            response.close()
+            self.workers = 0
+            return self.stream_bulk_data()
+        finally:
+            response.close()
+    
+    def download_bulk_data(self):
+        """Download Scryfall bulk data, returning None when nothing new was published"""
+        item = self.fetch_bulk_item()
+        if item is None:
+            return None
+        
+        download_url = item['download_uri']
+        last = self.last_bulk_info()
+        
+        data_dir = os.path.dirname(self.db_path) or '.'
+        os.makedirs(data_dir, exist_ok=True)
+        temp_path = os.path.join(data_dir, 'bulk_data.json')
+        part_path = temp_path + '.part'
+        meta_path = part_path + '.meta'
+        
+        # Resume a previous partial download of the same file
+        headers = {}
+        resume_from = 0
+        part_meta = {}
+        if os.path.exists(part_path) and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                part_meta = json.load(f)
+            if part_meta.get('updated_at') == item.get('updated_at'):
+                resume_from = os.path.getsize(part_path)
+        if resume_from:
+            headers['Range'] = f'bytes={resume_from}-'
+            if part_meta.get('etag'):
+                # Server sends the whole file instead if it changed underneath us
+                headers['If-Range'] = part_meta['etag']
+        elif last['etag']:
+            headers['If-None-Match'] = last['etag']
+        
+        print(f"Downloading from: {download_url}")
+        response = requests.get(download_url, stream=True, headers=headers, timeout=60)
+        
+        if response.status_code == 304:
+            print("Bulk data not modified (ETag match), skipping download")
+            return None
+        if response.status_code == 416 and resume_from and resume_from == item.get('size'):
+            # The previous run got every byte but stopped before the rename
+            response.close()
+        else:
+            response.raise_for_status()
+            
+            if response.status_code == 206:
+                print(f"Resuming download at byte {resume_from}")
+                mode = 'ab'
+            else:
+                mode = 'wb'
+            
+            etag = response.headers.get('ETag')
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'updated_at': item.get('updated_at'), 'etag': etag}, f)
+            part_meta['etag'] = etag
+            
+            # Download the JSON file (it's not actually gzipped)
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=65536):
+                    f.write(chunk)
+        
+        os.replace(part_path, temp_path)
+        os.remove(meta_path)
+        
+        self.bulk_info = {
+            'updated_at': item.get('updated_at'),
+            'etag': part_meta.get('etag'),
+            'size': item.get('size'),
+        }
+        return temp_path
+    
+    def iter_bulk_text(self, json_path):
+        """Yield the bulk file's text in READ_CHUNK_SIZE pieces"""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            yield from _read_chunks(f)
+    
+    def iter_bulk_cards(self, json_path):
+        """Yield cards from the bulk file one at a time without loading the whole dump"""
+        yield from iter_json_array(self.iter_bulk_text(json_path))
     
     def process_bulk_data(self, json_path):
-        """Process bulk data and update database"""
+        """Build a snapshot from the bulk file and atomically swap it into place; False if no card changed"""
         print("Processing bulk data...")
+        try:
+            if self.workers:
+                swapped = self.build_snapshot(lambda: self.load_card_lines(self.iter_bulk_text(json_path)))
+            else:
+                swapped = self.build_snapshot(lambda: self.load_cards(self.iter_bulk_cards(json_path)))
+        except BulkFormatError as e:
+            print(f"{e}; normalizing in this process instead")
+            swapped = self.build_snapshot(lambda: self.load_cards(self.iter_bulk_cards(json_path)))
         
-        cards_processed = 0
-        batch_size = 1000
-        batch = []
+        # Clean up
+        os.remove(json_path)
+        return swapped
+    
+    def build_snapshot(self, load):
+        """Build the cards from load() in a staging database and swap in a snapshot holding them.
         
-        with open(json_path, 'r', encoding='utf-8') as f:
-            import json
-            data = json.load(f)
+        load fills the cards and printings tables through self.cursor and returns the card
+        count. When the live snapshot has content hashes, the new one is a copy of it with
+        only the inserted, changed and deleted rows written, so the file changes no more
+        than the cards did; when nothing changed, the live file is left exactly as it is.
+        Returns True if a new snapshot was swapped in.
+        """
+        build_start = time.perf_counter()
+        self.build_time = datetime.now().isoformat()
+        
+        # Build next to the live file so the final rename stays on one filesystem
+        staging_path = self.db_path + '.building'
+        output_path = self.db_path + '.next'
+        for path in (staging_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        self.cursor.execute('SELECT EXISTS (SELECT 1 FROM cards WHERE content_hash IS NOT NULL)')
+        incremental = bool(self.cursor.fetchone()[0])
+        # Carry the update history over to a from-scratch snapshot
+        self.cursor.execute(f'''
+            SELECT {', '.join(UPDATE_COLUMNS)} FROM updates ORDER BY id
+        ''')
+        history = self.cursor.fetchall()
+        
+        live_conn = self.conn
+        self.conn = sqlite3.connect(staging_path)
+        self.cursor = self.conn.cursor()
+        
+        try:
+            for pragma in BULK_LOAD_PRAGMAS:
+                self.cursor.execute(pragma)
+            self.create_schema()
             
-            for card_data in data:
-                # Handle double-faced cards specially to get front face data
-                layout = card_data.get('layout', '')
-                name = card_data.get('name', '')
-                
-                # Initialize with default values
-                type_line = card_data.get('type_line', '')
-                colors = card_data.get('colors', [])
-                mana_cost = card_data.get('mana_cost', '')
-                
-                # Special handling for double-faced cards
-                if layout in ['transform', 'modal_dfc', 'reversible_card', 'adventure'] and 'card_faces' in card_data:
-                    card_faces = card_data.get('card_faces', [])
-                    if len(card_faces) >= 1:
-                        # Get front face data
-                        front_face = card_faces[0]
-                        
-                        # For transform/modal DFCs, use front face type and colors
-                        if layout in ['transform', 'modal_dfc', 'reversible_card']:
-                            type_line = front_face.get('type_line', type_line)
-                            colors = front_face.get('colors', colors)
-                            mana_cost = front_face.get('mana_cost', mana_cost)
-                        # For adventure cards, they have special handling
-                        elif layout == 'adventure':
-                            # Adventure cards show both faces in type_line already
-                            # But we need to check colors from both faces
-                            all_colors = set()
-                            for face in card_faces:
-                                face_colors = face.get('colors', [])
-                                all_colors.update(face_colors)
-                            colors = list(all_colors)
-                
-                types_array = self.extract_types_from_type_line(type_line)
-                
-                # Extract only the fields we need
-                card_entry = (
-                    name,
-                    card_data.get('ascii_name', ''),
-                    json.dumps(colors),  # Use corrected colors
-                    type_line,
-                    json.dumps(types_array),
-                    card_data.get('rarity', ''),
-                    mana_cost,  # Use corrected mana cost
-                    1 if card_data.get('foil', False) or card_data.get('nonfoil', False) else 0,
-                    layout,
-                    datetime.now().isoformat()
-                )
+            cards_processed = load()
+            self.hash_cards()
+            self.build_name_keys()
+            
+            if incremental:
+                self.conn.commit()
+                self.conn.close()
+                # Start from the live file itself; the staging build is only read from
+                live_conn.commit()
+                shutil.copyfile(self.db_path, output_path)
+                self.conn = sqlite3.connect(output_path)
+                self.cursor = self.conn.cursor()
+                self.cursor.execute('ATTACH DATABASE ? AS staging', (staging_path,))
+                delta = self.apply_delta()
+                if not any(delta.values()):
+                    print("No card changes; keeping the current snapshot")
+                    self.conn.rollback()
+                    self.conn.close()
+                    os.remove(output_path)
+                    os.remove(staging_path)
+                    self.conn = live_conn
+                    self.cursor = live_conn.cursor()
+                    self.save_bulk_seen()
+                    return False
+                self.conn.commit()
+                self.cursor.execute('DETACH DATABASE staging')
+                counts = (delta['cards_inserted'], delta['cards_changed'], delta['cards_deleted'])
+                print("Applied changes: " + ', '.join(f"{count} {name.replace('_', ' ')}"
+                                                     for name, count in delta.items()))
+            else:
+                print("Creating indexes...")
+                self.create_indexes()
                 
-                batch.append(card_entry)
+                self.cursor.executemany(f'''
+                    INSERT INTO updates ({', '.join(UPDATE_COLUMNS)})
+                    VALUES ({', '.join('?' for _ in UPDATE_COLUMNS)})
+                ''', history)
+                self.conn.commit()
                 
-                if len(batch) >= batch_size:
-                    self.insert_batch(batch)
-                    cards_processed += len(batch)
-                    print(f"Processed {cards_processed} cards...")
-                    batch = []
-        
-        # Insert remaining cards
-        if batch:
-            self.insert_batch(batch)
-            cards_processed += len(batch)
-        
-        # Update tracking
-        self.cursor.execute('''
-            INSERT INTO updates (last_bulk_update, card_count)
-            VALUES (?, ?)
-        ''', (datetime.now().isoformat(), cards_processed))
+                print("Compacting snapshot...")
+                self.cursor.execute('VACUUM')
+                output_path = staging_path
+                # A from-scratch build has nothing to count changes against
+                counts = (None, None, None)
+            
+            # Update tracking, last so the recorded build time covers the whole run
+            bulk_info = self.bulk_info or {}
+            self.cursor.execute('''
+                INSERT INTO updates (last_bulk_update, card_count, bulk_updated_at, bulk_etag, bulk_size,
+                                     build_seconds, cards_inserted, cards_changed, cards_deleted)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (self.build_time, cards_processed,
+                  bulk_info.get('updated_at'), bulk_info.get('etag'), bulk_info.get('size'),
+                  round(time.perf_counter() - build_start, 2)) + counts)
+            self.conn.commit()
+            self.conn.close()
+        except Exception:
+            # Leave the live snapshot untouched
+            self.conn.close()
+            for path in (staging_path, self.db_path + '.next'):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.conn = live_conn
+            self.cursor = live_conn.cursor()
+            raise
+        
+        # Readers holding the old file keep their snapshot until they reopen
+        live_conn.close()
+        os.replace(output_path, self.db_path)
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.cursor = self.conn.cursor()
         
-        self.conn.commit()
         print(f"Database updated! Total cards: {cards_processed}")
+        print(f"Peak memory: {peak_memory_mb()} MB")
+        return True
+    
+    def hash_cards(self):
+        """Fill content_hash for every card in the current connection"""
+        self.conn.create_function('content_hash', len(CARD_CONTENT_COLUMNS), content_hash,
+                                  deterministic=True)
+        self.cursor.execute(f'''
+            UPDATE cards SET content_hash = content_hash({', '.join(CARD_CONTENT_COLUMNS)})
+        ''')
+    
+    def apply_delta(self):
+        """Write the rows of the attached staging build that differ from main, returning counts per kind.
         
-        # Clean up
-        os.remove(json_path)
+        Unchanged cards keep their rows, and with them their last_updated.
+        """
+        columns = ', '.join(CARD_CONTENT_COLUMNS + ('last_updated', 'content_hash'))
+        delta = {}
+        
+        self.cursor.execute('''
+            DELETE FROM main.cards WHERE name NOT IN (SELECT name FROM staging.cards)
+        ''')
+        delta['cards_deleted'] = self.cursor.rowcount
+        self.cursor.execute(f'''
+            SELECT {columns} FROM staging.cards s
+            WHERE s.content_hash IS NOT (SELECT m.content_hash FROM main.cards m WHERE m.name = s.name)
+        ''')
+        rows = self.cursor.fetchall()
+        self.cursor.execute('SELECT name FROM main.cards')
+        existing = {name for name, in self.cursor.fetchall()}
+        changed = [row[1:] + row[:1] for row in rows if row[0] in existing]
+        inserted = [row for row in rows if row[0] not in existing]
+        self.cursor.executemany(f'''
+            UPDATE main.cards SET {', '.join(f'{column} = ?' for column in columns.split(', ')[1:])}
+            WHERE name = ?
+        ''', changed)
+        self.cursor.executemany(f'''
+            INSERT INTO main.cards ({columns}) VALUES ({', '.join('?' for _ in columns.split(', '))})
+        ''', inserted)
+        delta['cards_changed'] = len(changed)
+        delta['cards_inserted'] = len(inserted)
+        
+        # Printings and lookup keys are small rows without a hash: compare them whole
+        for table, columns, key in (
+                ('printings', 'set_code, collector_number, name, rarity, finishes, scryfall_id, released_at',
+                 'set_code, collector_number'),
+                ('name_keys', 'key, name, priority', 'key, name, priority')):
+            key_width = len(key.split(', '))
+            self.cursor.execute(f'''
+                SELECT {key} FROM (SELECT {columns} FROM main.{table}
+                                   EXCEPT SELECT {columns} FROM staging.{table})
+            ''')
+            removed = self.cursor.fetchall()
+            self.cursor.executemany(f'''
+                DELETE FROM main.{table} WHERE ({key}) = ({', '.join('?' * key_width)})
+            ''', removed)
+            self.cursor.execute(f'''
+                INSERT INTO main.{table} ({columns})
+                SELECT {columns} FROM staging.{table} EXCEPT SELECT {columns} FROM main.{table}
+            ''')
+            delta[f'{table}_written'] = len(removed) + self.cursor.rowcount
+        return delta
+    
+    def create_indexes(self):
+        """Create secondary indexes, done after the bulk load so inserts stay cheap"""
+        # Covering index: a lookup never has to touch the name_keys table itself
+        self.cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_name_keys_key ON name_keys (key, priority, name)
+        ''')
+        self.cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_printings_set_number
+            ON printings (set_code, collector_number)
+        ''')
+    
+    def build_name_keys(self):
+        """Fill name_keys from the cards table: names, ascii names and face aliases"""
+        self.cursor.execute('DELETE FROM name_keys')
+        self.cursor.execute('SELECT name, asciiName FROM cards')
+        keys = set()
+        for name, ascii_name in self.cursor.fetchall():
+            keys.add((normalize_name(name), name, 0))
+            if ascii_name:
+                keys.add((normalize_name(ascii_name), name, 1))
+            
+            # Face aliases for split, DFC, adventure and flip cards ("Fire" -> "Fire // Ice")
+            if ' // ' in name:
+                for face in name.split(' // '):
+                    keys.add((normalize_name(face), name, 2))
+                if ascii_name and ' // ' in ascii_name:
+                    for face in ascii_name.split(' // '):
+                        keys.add((normalize_name(face), name, 3))
+        
+        # Sorted inserts keep the index build sequential
+        self.cursor.executemany(
+            'INSERT INTO name_keys (key, name, priority) VALUES (?, ?, ?)', sorted(keys))
+        self.cursor.execute(f'PRAGMA user_version = {NAME_KEY_VERSION}')
+    
+    def normalize_card(self, card_data):
+        """One bulk entry as (cards row, printings row or None, (name, printing rank, scryfall id))"""
+        # Handle double-faced cards specially to get front face data
+        layout = card_data.get('layout', '')
+        name = card_data.get('name', '')
+        
+        # Initialize with default values
+        type_line = card_data.get('type_line', '')
+        colors = card_data.get('colors', [])
+        mana_cost = card_data.get('mana_cost', '')
+        
+        # Special handling for double-faced cards
+        if layout in ['transform', 'modal_dfc', 'reversible_card', 'adventure'] and 'card_faces' in card_data:
+            card_faces = card_data.get('card_faces', [])
+            if len(card_faces) >= 1:
+                # Get front face data
+                front_face = card_faces[0]
+                
+                # For transform/modal DFCs, use front face type and colors
+                if layout in ['transform', 'modal_dfc', 'reversible_card']:
+                    type_line = front_face.get('type_line', type_line)
+                    colors = front_face.get('colors', colors)
+                    mana_cost = front_face.get('mana_cost', mana_cost)
+                # For adventure cards, they have special handling
+                elif layout == 'adventure':
+                    # Adventure cards show both faces in type_line already
+                    # But we need to check colors from both faces
+                    all_colors = set()
+                    for face in card_faces:
+                        face_colors = face.get('colors', [])
+                        all_colors.update(face_colors)
+                    colors = list(all_colors)
+        
+        colors = color_mask(colors)
+        types = type_mask(self.extract_types_from_type_line(type_line))
+        rarity = card_data.get('rarity', '')
+        finishes = printing_finishes(card_data)
+        
+        # Extract only the fields we need
+        card_entry = (
+            name,
+            card_data.get('ascii_name', ''),
+            colors,  # Use corrected colors
+            type_line,
+            types,
+            rarity,
+            mana_cost,  # Use corrected mana cost
+            # Foil if this printing has a foil finish at all; a non-foil-only printing doesn't count
+            1 if {'foil', 'etched'} & set(finishes.split(',')) else 0,
+            layout,
+            self.build_time
+        ) + self.classify_card(name, colors, types, rarity, mana_cost, type_line)
+        
+        set_code = (card_data.get('set') or '').lower()
+        printing = None
+        if set_code:
+            printing = (set_code, card_data.get('collector_number') or '', name, rarity,
+                        finishes, card_data.get('id'),
+                        card_data.get('released_at'))
+        
+        return card_entry, printing, (name, printing_rank(card_data), card_data.get('id'))
+    
+    def load_cards(self, cards):
+        """Normalize bulk entries and write them into the current connection, returning the count"""
+        return self.write_cards(self.normalize_card(card_data) for card_data in cards)
+    
+    def load_card_lines(self, chunks):
+        """load_cards from the raw text of a one-card-per-line bulk file, decoding and
+        normalizing across self.workers processes"""
+        batches = self.normalize_line_batches(_batched(_iter_item_lines(chunks), PIPELINE_BATCH_SIZE))
+        return self.write_cards(row for batch in batches for row in batch)
+    
+    def normalize_batches(self, batches):
+        """normalize_card over batches of parsed bulk entries, in this process"""
+        for batch in batches:
+            yield [self.normalize_card(card_data) for card_data in batch]
+    
+    def normalize_line_batches(self, batches):
+        """Decode and normalize batches of raw bulk lines in a pool of self.workers processes.
+        
+        Workers get the text rather than parsed dicts: pickling a parsed card
+        costs about as much as normalizing it, while a line is a plain string.
+        """
+        with _pool_context().Pool(self.workers, initializer=_init_normalize_worker,
+                                  initargs=(self.build_time,)) as pool:
+            # Results come back in submission order, so rows are written exactly as
+            # in-process; the window keeps finished batches from piling up behind a slow writer
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_normalize_lines, (batch,)))
+                if len(pending) >= self.workers * 2:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+    
+    def load_cards_pipelined(self, chunks):
+        """load_cards from raw bulk bytes, with reading, parsing and normalizing each on its own
+        thread so the download and the SQLite writer (this thread) stay busy together"""
+        pipeline = BuildPipeline()
+        raw = pipeline.stage('read', lambda _: chunks, unit='KB', size=lambda chunk: len(chunk) / 1024)
+        if self.workers:
+            # Split into lines here; decoding happens in the pool along with normalizing
+            framed = pipeline.stage(
+                'frame', lambda chunks: _batched(_iter_item_lines(_decode_chunks(chunks)), PIPELINE_BATCH_SIZE),
+                raw, unit='cards')
+            normalized = pipeline.stage('normalize', self.normalize_line_batches, framed, unit='cards')
+        else:
+            parsed = pipeline.stage(
+                'parse', lambda chunks: _batched(iter_json_array(_decode_chunks(chunks)), PIPELINE_BATCH_SIZE),
+                raw, unit='cards')
+            normalized = pipeline.stage('normalize', self.normalize_batches, parsed, unit='cards')
+        try:
+            count = self.write_cards(row for batch in pipeline.consume('write', normalized, unit='cards')
+                                     for row in batch)
+        except BaseException as e:
+            pipeline.stop(e)
+            raise
+        pipeline.finish()
+        return count
+    
+    def write_cards(self, normalized):
+        """Merge normalize_card results into one row per card, then insert the rows in bulk.
+        
+        A card's row comes from its canonical printing (the highest printing_rank), so
+        the result doesn't depend on dump order, and hasFoil is set when any printing
+        comes in foil. Printings are written in batches as they arrive. Returns the
+        number of cards.
+        """
+        printings_processed = 0
+        batch_size = 1000
+        printings = []
+        seen_printings = set()
+        # name -> [rank, cards row, scryfall id, any printing in foil] of the best printing so far
+        merged = {}
+        
+        for card_entry, printing, (name, rank, scryfall_id) in normalized:
+            if printing is not None and printing[:2] not in seen_printings:
+                seen_printings.add(printing[:2])
+                printings.append(printing)
+                if len(printings) >= batch_size:
+                    self.insert_printings(printings)
+                    printings = []
+            
+            card = merged.get(name)
+            if card is None:
+                merged[name] = [rank, card_entry, scryfall_id, card_entry[7]]
+            else:
+                if rank > card[0]:
+                    card[:3] = rank, card_entry, scryfall_id
+                card[3] |= card_entry[7]
+            
+            printings_processed += 1
+            if printings_processed % batch_size == 0:
+                print(f"Processed {printings_processed} printings...")
+        
+        if printings:
+            self.insert_printings(printings)
+        
+        # Name order, so the table is laid out the same whatever order the dump came in
+        rows = [card_entry[:7] + (has_foil,) + card_entry[8:] + (scryfall_id,)
+                for _, card_entry, scryfall_id, has_foil in (merged[name] for name in sorted(merged))]
+        for start in range(0, len(rows), batch_size):
+            self.insert_batch(rows[start:start + batch_size])
+        print(f"Merged {printings_processed} printings into {len(rows)} cards")
+        
+        return len(rows)
     
     def extract_types_from_type_line(self, type_line):
         """Extract card types from type line like 'Creature — Elf Warrior'"""
@@ -188,26 +1241,86 @@ class MTGDatabase:
         type_part = type_line.split(' — ')[0]
         
         # Split by space and filter
-        possible_types = ['Land', 'Creature', 'Artifact', 'Enchantment', 
-                          'Instant', 'Sorcery', 'Planeswalker', 'Battle', 
-                          'Token', 'Emblem', 'Scheme', 'Conspiracy', 
-                          'Phenomenon', 'Vanguard', 'Hero']
-        
         found_types = []
-        for card_type in possible_types:
+        for card_type in CARD_TYPES:
             if card_type in type_part:
                 found_types.append(card_type)
         
         return found_types
     
+    def classify_card(self, name, colors, types, rarity, mana_cost, type_line):
+        """Work out (color_group, rarity_group, sort_key) the way the sorter groups a card.
+        
+        colors and types are the bitmasks stored in the cards table.
+        """
+        rarity_group = rarity_group_for(rarity)
+        
+        color_group = 'Unknown'
+        is_double_faced = ' // ' in name
+        
+        # Check mana cost for colors
+        all_colors = colors
+        mana_cost = mana_cost or ''
+        if mana_cost:
+            for symbol, bit in COLOR_BITS.items():
+                if f'{{{symbol}}}' in mana_cost:
+                    all_colors |= bit
+        color_count = bin(all_colors).count('1')
+        type_str = type_line or ''
+        
+        if is_double_faced and ' // ' in type_str:
+            front_type = type_str.split(' // ')[0]
+        else:
+            front_type = type_str
+        
+        # Lands WITHOUT colors (basic lands, etc.)
+        # BUT: If it's a double-faced card where front is NOT a land, don't put in Land group
+        if types & TYPE_BITS['Land'] and not all_colors:
+            # Double-faced cards with a non-land front are grouped by the front below
+            if not is_double_faced or 'Land' in front_type:
+                color_group = 'Land'
+        
+        if color_group == 'Unknown':
+            special_types = ["Token", "Emblem", "Scheme", "Conspiracy", 
+                             "Phenomenon", "Vanguard", "Hero"]
+            if any(special_type in front_type for special_type in special_types):
+                is_regular_card = any(regular_type in front_type for regular_type in 
+                                      ["Creature", "Planeswalker", "Instant", "Sorcery", 
+                                       "Enchantment", "Artifact", "Land", "Battle"])
+                if not is_regular_card:
+                    color_group = 'Special Cards'
+        
+        if color_group == 'Unknown':
+            front_is_artifact = 'Artifact' in front_type
+            if front_is_artifact and not all_colors:
+                color_group = 'Artifact'
+            elif color_count == 1:
+                color_map = {'W': 'White', 'U': 'Blue', 'B': 'Black', 'R': 'Red', 'G': 'Green'}
+                color_group = color_map.get(mask_names(all_colors, CARD_COLORS)[0], 'Unknown')
+            elif color_count >= 2:
+                color_group = 'Multicolor'
+            else:
+                color_group = 'Colorless'
+        
+        return (color_group, rarity_group, name.lower())
+    
     def insert_batch(self, batch):
-        """Insert a batch of cards (upsert to handle updates)"""
+        """Insert a batch of cards, one row per name"""
         self.cursor.executemany('''
-            INSERT OR REPLACE INTO cards 
-            (name, asciiName, colors, type, types, rarity, manaCost, hasFoil, layout, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO cards 
+            (name, asciiName, colors, type, types, rarity, manaCost, hasFoil, layout, last_updated,
+             color_group, rarity_group, sort_key, canonical_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', batch)
     
+    def insert_printings(self, printings):
+        """Insert a batch of printing rows"""
+        self.cursor.executemany('''
+            INSERT INTO printings
+            (set_code, collector_number, name, rarity, finishes, scryfall_id, released_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', printings)
+    
     def build_or_update(self):
         """Main method to build or update database"""
         print("Initializing MTG card database...")
@@ -216,9 +1329,10 @@ class MTGDatabase:
         if self.needs_update():
             print("Database is out of date, updating...")
             try:
-                json_path = self.download_bulk_data()
-                self.process_bulk_data(json_path)
-                print("Database update complete!")
+                if self.update_snapshot():
+                    print("Database update complete!")
+                else:
+                    print("No new or changed cards, keeping existing database.")
             except Exception as e:
                 print(f"Update failed: {e}")
                 print("Using existing database...")
@@ -229,6 +1343,44 @@ class MTGDatabase:
     
     
 
+def build_worker_count(setting):
+    """Normalizing processes for a BUILD_WORKERS value ('auto' is one per core)"""
+    if setting == 'auto':
+        return os.cpu_count() or 1
+    return max(0, int(setting))
+
+
+def _pool_context():
+    """Start method for the normalizing pool: a fork server, or spawn where there is none"""
+    # Never a plain fork: builds run next to other threads (pipeline stages, the app's
+    # refresher, metrics flusher), and a forked child can inherit a lock one of them held
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# The normalizer each pool process builds once, holding only the build's timestamp
+_worker_normalizer = None
+
+
+def _init_normalize_worker(build_time):
+    global _worker_normalizer
+    # normalize_card needs neither a connection nor __init__'s startup output
+    _worker_normalizer = MTGDatabase.__new__(MTGDatabase)
+    _worker_normalizer.build_time = build_time
+
+
+def _normalize_lines(lines):
+    rows = []
+    for line in lines:
+        try:
+            card_data = json.loads(line)
+        except ValueError:
+            raise BulkFormatError(f"Bulk data line is not a whole card: {line[:60]!r}")
+        rows.append(_worker_normalizer.normalize_card(card_data))
+    return rows
+
+
 # Helper function for your app
 def get_database_connection():
     """Get database connection, building/updating if needed"""
@@ -0,0 +1,100 @@
+# fuzzy_index.py - Typo-tolerant matching for names that miss the exact lookup
+import heapq
+from collections import Counter
+from difflib import SequenceMatcher
+
+from database_builder import normalize_name
+
+# A best score at least this high, with a clear lead over the runner-up,
+# is treated as a match instead of a suggestion
+AUTO_RESOLVE_SCORE = 0.9
+AUTO_RESOLVE_MARGIN = 0.03
+
+# Anything scoring below this is too far off to be worth suggesting
+SUGGESTION_SCORE = 0.6
+
+# Keys sharing nearly as many trigrams as the best candidate are shortlisted,
+# then the top few are re-scored by edit similarity
+SHORTLIST_SLACK = 2
+RESCORE_SIZE = 6
+
+# Trigrams shared by more keys than this ("the", "of ") say little about a
+# match and dominate the cost, so they are skipped when rarer ones exist
+COMMON_GRAM_POSTINGS = 500
+MIN_RARE_GRAMS = 3
+
+
+def trigrams(key):
+    """Character trigrams of a lookup key, padded so short names still get a few"""
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """Trigram inverted index over every lookup key (names, ascii names, face names)"""
+
+    def __init__(self, entries):
+        """entries: iterable of (lookup key, card name)"""
+        self.keys = []
+        self.names = []
+        self.sizes = []
+        self.postings = {}
+        for key, name in entries:
+            key_id = len(self.keys)
+            grams = trigrams(key)
+            self.keys.append(key)
+            self.names.append(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(key_id)
+
+    @classmethod
+    def load(cls, conn):
+        """Build from a snapshot's name_keys, keeping the same precedence as find_cards"""
+        best = {}
+        for key, name in conn.execute(
+                'SELECT key, name FROM name_keys ORDER BY priority DESC, name DESC'):
+            best[key] = name
+        return cls(best.items())
+
+    def match(self, name, limit=3):
+        """Closest card names as [(name, score)], best first; score is 0..1"""
+        key = normalize_name(name)
+        grams = trigrams(key)
+
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        rare = [posting for posting in postings if len(posting) <= COMMON_GRAM_POSTINGS]
+        if len(rare) >= MIN_RARE_GRAMS:
+            postings = rare
+
+        counts = Counter()
+        for posting in postings:
+            counts.update(posting)
+        if not counts:
+            return []
+
+        # Dice coefficient on trigram sets picks the shortlist cheaply...
+        size = len(grams)
+        cutoff = max(counts.values()) - SHORTLIST_SLACK
+        candidates = [key_id for key_id, shared in counts.items() if shared >= cutoff]
+        shortlist = heapq.nlargest(
+            RESCORE_SIZE, ((2 * counts[key_id] / (size + self.sizes[key_id]), key_id) for key_id in candidates))
+
+        # ...and edit similarity ranks what's left
+        scored = {}
+        for _, key_id in shortlist:
+            score = SequenceMatcher(None, key, self.keys[key_id]).ratio()
+            card_name = self.names[key_id]
+            if score >= SUGGESTION_SCORE and score > scored.get(card_name, 0):
+                scored[card_name] = score
+
+        ranked = sorted(scored.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(card_name, round(score, 3)) for card_name, score in ranked]
+
+    def resolve(self, matches):
+        """The card name to use without asking, or None if the matches are only suggestions"""
+        if not matches or matches[0][1] < AUTO_RESOLVE_SCORE:
+            return None
+        if len(matches) > 1 and matches[0][1] - matches[1][1] < AUTO_RESOLVE_MARGIN:
+            return None
+        return matches[0][0]
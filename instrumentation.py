@@ -0,0 +1,161 @@
+# instrumentation.py - Per-request stage timers, Server-Timing headers and sampled logging
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+from metrics import record_request
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+# Share of requests that log a summary line (and, at DEBUG, one line per
+# entry); slow requests and errors are always logged
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.1'))
+LOG_SLOW_MS = float(os.environ.get('LOG_SLOW_MS', '1000'))
+
+# How often each worker logs its aggregated stage timings
+STATS_LOG_SECONDS = float(os.environ.get('STATS_LOG_SECONDS', '60'))
+
+logger = logging.getLogger('mtg.requests')
+
+
+def configure_logging():
+    """Leveled logging with the worker pid on every line (gunicorn runs several)"""
+    logging.basicConfig(level=LOG_LEVEL,
+                        format='%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s')
+
+
+def log_event(log, level, event, **fields):
+    """One structured line: the event name, then its fields as compact JSON"""
+    if log.isEnabledFor(level):
+        log.log(level, '%s %s', event, json.dumps(fields, separators=(',', ':'), default=str))
+
+
+class RequestTimer:
+    """Wall time per named stage of one request, plus fields for its summary line"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._mark = self.start
+        self.stages = {}
+        self.fields = {}
+        self.sampled = random.random() < LOG_SAMPLE_RATE
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def lap(self, name=None):
+        """Charge the time since the previous lap to a stage (no name: just restart the lap)"""
+        now = time.perf_counter()
+        if name is not None:
+            self.add(name, (now - self._mark) * 1000)
+        self._mark = now
+
+    def add(self, name, ms):
+        """Add time to a stage; stages entered more than once (streamed groups) accumulate"""
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self):
+        """Server-Timing header value: each stage, then the total so far"""
+        parts = [f'{name};dur={ms:.1f}' for name, ms in self.stages.items()]
+        parts.append(f'total;dur={self.elapsed_ms():.1f}')
+        return ', '.join(parts)
+
+
+def current_timer():
+    """The timer of the request being handled, or None outside a request"""
+    return g.get('timer') if has_request_context() else None
+
+
+class WorkerStats:
+    """Stage timings aggregated over every request this process has served"""
+
+    def __init__(self):
+        self.requests = 0
+        self.stages = {}
+        self.last_logged = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, stages, total_ms):
+        with self._lock:
+            self.requests += 1
+            for name, ms in list(stages.items()) + [('total', total_ms)]:
+                count, total, peak = self.stages.get(name, (0, 0.0, 0.0))
+                self.stages[name] = (count + 1, total + ms, max(peak, ms))
+
+    def snapshot(self):
+        """{'requests': n, 'stages': {stage: {'count', 'total_ms', 'max_ms'}}}"""
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'stages': {name: {'count': count, 'total_ms': round(total, 1), 'max_ms': round(peak, 1)}
+                           for name, (count, total, peak) in self.stages.items()},
+            }
+
+    def maybe_log(self):
+        """Log the per-worker aggregate at most once every STATS_LOG_SECONDS"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self.last_logged < STATS_LOG_SECONDS:
+                return
+            self.last_logged = now
+        stats = self.snapshot()
+        log_event(logger, logging.INFO, 'worker_stats', pid=os.getpid(), requests=stats['requests'],
+                  mean_ms={name: round(stage['total_ms'] / stage['count'], 1)
+                           for name, stage in stats['stages'].items()})
+
+
+worker_stats = WorkerStats()
+
+
+class Instrumentation:
+    """Starts a RequestTimer per request and reports it once the response is finished"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Register before the other after_request hooks so this one runs last
+        # and its header includes their stages (compression)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        g.timer = RequestTimer()
+
+    def after_request(self, response):
+        timer = g.get('timer')
+        if timer is None:
+            return response
+        # Streamed bodies are still to be produced, so their header only
+        # covers the stages run so far; the summary is taken once they finish
+        response.headers.add('Server-Timing', timer.server_timing())
+        path, status = request.path, response.status_code
+        # The view name, not the path, labels metrics: unknown paths can't add series
+        endpoint = request.endpoint or 'unmatched'
+        response.call_on_close(lambda: self.finish(timer, path, endpoint, status))
+        return response
+
+    def finish(self, timer, path, endpoint, status):
+        total_ms = timer.elapsed_ms()
+        worker_stats.record(timer.stages, total_ms)
+        record_request(endpoint, status, total_ms, timer.stages, timer.fields)
+        if timer.sampled or total_ms >= LOG_SLOW_MS or status >= 500:
+            level = logging.WARNING if status >= 500 else logging.INFO
+            log_event(logger, level, 'request', path=path, status=status, total_ms=round(total_ms, 1),
+                      stages={name: round(ms, 1) for name, ms in timer.stages.items()}, **timer.fields)
+        worker_stats.maybe_log()
@@ -0,0 +1,310 @@
+# metrics.py - Prometheus metrics summed across gunicorn workers through per-worker files
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from database_builder import open_read_only
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, no exited workers to fold in
+    fcntl = None
+
+# Each worker writes its counters here; /metrics adds them all up, so files
+# of workers that have exited keep counting toward the totals
+METRICS_DIR = os.environ.get('METRICS_DIR', 'data/metrics')
+
+# Totals of workers that have exited, folded into one file so the directory
+# (and every scrape) doesn't grow with each restart
+AGGREGATE_FILE = 'aggregate.json'
+
+# How often a worker writes its file when it has new values (also on exit and on every scrape it serves)
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 1000, 2500, 10000, 25000, 100000)
+RATE_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 1000000)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'mtg_requests_total': ('counter', 'Requests served, by endpoint and status', None),
+    'mtg_request_duration_seconds': ('histogram', 'Request latency by endpoint', LATENCY_BUCKETS),
+    'mtg_stage_duration_seconds': (
+        'histogram', '/process_list time per stage (parse, lookup, classify, sort, serialize, compress)',
+        LATENCY_BUCKETS),
+    'mtg_list_lines': ('histogram', 'Entries per submitted list', SIZE_BUCKETS),
+    'mtg_list_unique_names': ('histogram', 'Distinct card names per submitted list', SIZE_BUCKETS),
+    'mtg_list_cards_per_second': ('histogram', 'Entries processed per second of request time', RATE_BUCKETS),
+    'mtg_cards_found_total': ('counter', 'Entries matched to a card', None),
+    'mtg_cards_not_found_total': ('counter', 'Entries that matched no card', None),
+    'mtg_cards_fuzzy_total': ('counter', 'Entries matched only by fuzzy name lookup (included in mtg_cards_found_total)', None),
+    'mtg_result_cache_requests_total': ('counter', 'Result cache outcomes (hit, not_modified, miss)', None),
+}
+
+
+def _merge_into(target, values):
+    """Add one file's {name: {labels: value}} into target"""
+    for name, series in values.items():
+        merged = target.setdefault(name, {})
+        for key, value in series.items():
+            if isinstance(value, list):
+                current = merged.setdefault(key, [0] * len(value))
+                merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _worker_exited(path):
+    """Whether the worker that wrote worker-<pid>-<ns>.json is gone"""
+    try:
+        pid = int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def _labels(labels):
+    """Exposition-format label string, e.g. 'endpoint="process_list",status="200"'"""
+    return ','.join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """This worker's counters and histograms, plus the merged view across all workers"""
+
+    def __init__(self, directory=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # name -> {label string: value} for counters,
+        # name -> {label string: [count per bucket..., +Inf, sum]} for histograms
+        self.values = {}
+        self.pid = os.getpid()
+        # pid alone can be reused by a later worker and overwrite a dead one's totals
+        self.path = os.path.join(self.directory, f'worker-{self.pid}-{time.time_ns()}.json')
+        self.dirty = False
+        self.flusher = None
+
+    def _own(self):
+        # A forked child (gunicorn --preload imports before forking) starts from zero,
+        # not its parent's counts, and needs its own flusher (threads don't survive a fork)
+        if self.pid != os.getpid():
+            self._reset()
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._own()
+            series = self.values.setdefault(name, {})
+            key = _labels(labels)
+            series[key] = series.get(key, 0) + value
+            self.dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._own()
+            series = self.values.setdefault(name, {})
+            key = _labels(labels)
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 2)
+            # Only the value's own bucket; render makes them cumulative
+            state[bisect.bisect_left(buckets, value)] += 1
+            state[-1] += value
+            self.dirty = True
+
+    def flush(self):
+        """Write this worker's values to its file (atomically, so a scrape never reads half a file)"""
+        with self._lock:
+            if self.pid != os.getpid() or not self.dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.values, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+    @contextmanager
+    def _merge_lock(self):
+        """Serialize compaction and reads across processes"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.merge.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def compact(self):
+        """Fold the files of workers that have exited into the aggregate file; returns the aggregate.
+
+        Call with _merge_lock held. The aggregate lists the files it has taken in, so
+        they are never counted twice, even if this process dies between writing it and
+        deleting them.
+        """
+        aggregate_path = os.path.join(self.directory, AGGREGATE_FILE)
+        aggregate = _read_json(aggregate_path) or {'values': {}, 'merged': []}
+        if fcntl is None:
+            return aggregate
+        merged = set(aggregate['merged'])
+        exited = []
+        for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+            if os.path.basename(path) in merged or not _worker_exited(path):
+                continue
+            values = _read_json(path)
+            if values is not None:
+                _merge_into(aggregate['values'], values)
+            exited.append(path)
+
+        # Files counted earlier but not deleted yet still are; names of deleted ones can go
+        leftover = [os.path.join(self.directory, name) for name in aggregate['merged']
+                    if os.path.exists(os.path.join(self.directory, name))]
+        if exited or len(leftover) != len(aggregate['merged']):
+            aggregate['merged'] = [os.path.basename(path) for path in leftover + exited]
+            tmp_path = aggregate_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(aggregate, f)
+            os.replace(tmp_path, aggregate_path)
+        for path in leftover + exited:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return aggregate
+
+    def collect(self):
+        """Every worker's values added together, exited ones included"""
+        self.flush()
+        with self._merge_lock():
+            aggregate = self.compact()
+            merged = {}
+            _merge_into(merged, aggregate['values'])
+            skip = set(aggregate['merged'])
+            for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+                if os.path.basename(path) in skip:
+                    continue
+                values = _read_json(path)
+                if values is not None:
+                    _merge_into(merged, values)
+        return merged
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of the merged values, followed by (name, help, value) gauges"""
+        merged = self.collect()
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for key, value in sorted(merged.get(name, {}).items()):
+                if metric_type == 'counter':
+                    lines.append(f'{name}{{{key}}} {value}' if key else f'{name} {value}')
+                    continue
+                prefix = key + ',' if key else ''
+                count = 0
+                for bound, in_bucket in zip(buckets + ('+Inf',), value):
+                    count += in_bucket
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                suffix = f'{{{key}}}' if key else ''
+                lines.append(f'{name}_sum{suffix} {round(value[-1], 6)}')
+                lines.append(f'{name}_count{suffix} {count}')
+        for name, help_text, value in gauges:
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+
+
+def record_request(endpoint, status, total_ms, stages, fields):
+    """Fold one finished request into this worker's metrics"""
+    registry.inc('mtg_requests_total', endpoint=endpoint, status=status)
+    registry.observe('mtg_request_duration_seconds', total_ms / 1000, endpoint=endpoint)
+    if endpoint == 'process_list':
+        for stage, ms in stages.items():
+            registry.observe('mtg_stage_duration_seconds', ms / 1000, stage=stage)
+        cache = fields.get('cache')
+        if cache is not None:
+            if cache == 'hit' and status == 304:
+                cache = 'not_modified'
+            registry.inc('mtg_result_cache_requests_total', result=cache)
+        if 'entries' in fields:
+            registry.observe('mtg_list_lines', fields['entries'])
+            registry.observe('mtg_list_unique_names', fields['unique'])
+            registry.inc('mtg_cards_found_total', fields['found'])
+            registry.inc('mtg_cards_not_found_total', fields['not_found'])
+            registry.inc('mtg_cards_fuzzy_total', fields['fuzzy'])
+            if total_ms > 0:
+                registry.observe('mtg_list_cards_per_second', fields['entries'] / (total_ms / 1000))
+
+
+def snapshot_gauges(db_path):
+    """(name, help, value) gauges for the snapshot on disk, read from its updates table"""
+    try:
+        conn = open_read_only(db_path)
+        try:
+            row = conn.execute('''
+                SELECT last_bulk_update, card_count, build_seconds
+                FROM updates ORDER BY id DESC LIMIT 1
+            ''').fetchone()
+        finally:
+            conn.close()
+    except Exception:
+        row = None
+    if row is None:
+        return [('mtg_snapshot_up', 'Whether the card snapshot could be read', 0)]
+
+    last_update, card_count, build_seconds = row
+    age = None
+    if last_update:
+        try:
+            age = round((datetime.now() - datetime.fromisoformat(last_update)).total_seconds(), 1)
+        except ValueError:
+            pass
+    return [
+        ('mtg_snapshot_up', 'Whether the card snapshot could be read', 1),
+        ('mtg_snapshot_age_seconds', 'Seconds since the snapshot was last rebuilt', age),
+        ('mtg_snapshot_cards', 'Cards in the snapshot', card_count),
+        ('mtg_snapshot_build_seconds', 'Duration of the process_bulk_data run that built the snapshot',
+         build_seconds),
+    ]
@@ -0,0 +1,92 @@
+# refresher.py - Background snapshot refresh, single-flight across gunicorn workers
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import schedule
+
+from database_builder import MTGDatabase
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server, nothing to coordinate
+    fcntl = None
+
+# Hours between refresh checks; 0 turns the background refresher off
+REFRESH_INTERVAL_HOURS = float(os.environ.get('REFRESH_INTERVAL_HOURS', '24'))
+
+
+class SnapshotBusy(Exception):
+    """Another process holds the refresh lock"""
+
+
+@contextmanager
+def snapshot_lock(db_path, blocking=True):
+    """Hold an exclusive lock shared by every process that writes the snapshot"""
+    lock_path = os.path.join(os.path.dirname(db_path) or '.', '.refresh.lock')
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except BlockingIOError:
+                raise SnapshotBusy(lock_path)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def refresh_snapshot(db_path):
+    """Download and rebuild if Scryfall has new data; returns True if a new snapshot was swapped in"""
+    try:
+        with snapshot_lock(db_path, blocking=False):
+            db = MTGDatabase(db_path)
+            db.initialize()
+            try:
+                # Conditional: a worker that just lost the race finds nothing new here
+                return db.update_snapshot()
+            finally:
+                db.conn.close()
+    except SnapshotBusy:
+        print(f"Refresh already running in another process (pid {os.getpid()} skipping)")
+        return False
+    except Exception as e:
+        # Keep serving the old snapshot; the next run tries again
+        print(f"Background refresh failed: {e}")
+        return False
+
+
+class Refresher:
+    """Runs refresh_snapshot on a schedule in a daemon thread, once per process"""
+
+    def __init__(self, db_path='data/mtg_cards.sqlite', interval_hours=REFRESH_INTERVAL_HOURS,
+                 poll_seconds=60):
+        self.db_path = db_path
+        self.interval_hours = interval_hours
+        self.poll_seconds = poll_seconds
+        self.scheduler = schedule.Scheduler()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            self.scheduler.run_pending()
+            time.sleep(self.poll_seconds)
+
+    def start(self):
+        """Start the scheduler thread (no-op if disabled or already running in this process)"""
+        if self.interval_hours <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.scheduler.clear()
+            self.scheduler.every(self.interval_hours).hours.do(refresh_snapshot, self.db_path)
+            thread = threading.Thread(target=self._run, name='snapshot-refresher', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+            print(f"Snapshot refresher running every {self.interval_hours}h (pid {self._pid})")
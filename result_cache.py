@@ -0,0 +1,287 @@
+# result_cache.py - Content-addressed cache of finished /process_list responses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import Response, g, request
+
+from database_builder import NAME_KEY_VERSION
+
+# Bump when the response body changes shape so old entries (and ETags) stop matching
+CACHE_FORMAT = 2
+
+# Modules whose code decides what a response holds (parsing, lookup, fuzzy
+# matching, classification). Their digest is part of every key, so a deploy
+# that changes any of them never serves bodies or ETags from the old code
+RESPONSE_MODULES = ('app.py', 'card_parser.py', 'card_index.py', 'database_builder.py',
+                    'fuzzy_index.py', 'result_cache.py')
+
+# RESULT_CACHE: 'memory' (per worker), 'disk' (shared by every worker), or 'off'
+RESULT_CACHE = os.environ.get('RESULT_CACHE', 'memory')
+RESULT_CACHE_MB = float(os.environ.get('RESULT_CACHE_MB', '64'))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', 'data/result_cache')
+
+# Disk backend: a full scan of the directory for eviction runs when this
+# process's running total passes the limit, or after this many writes (other
+# workers write to the same directory)
+EVICT_EVERY = 100
+# ...and trims it to this share of the limit, so a full cache isn't rescanned on every write
+EVICT_TO = 0.8
+
+logger = logging.getLogger('mtg.result_cache')
+
+
+def code_version():
+    """RESULT_CACHE_VERSION if set (e.g. the deployed commit), else a digest of RESPONSE_MODULES"""
+    version = os.environ.get('RESULT_CACHE_VERSION')
+    if version:
+        return version
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in RESPONSE_MODULES:
+        try:
+            with open(os.path.join(here, name), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(name.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = code_version()
+
+# Pasted text -> entries digest, so an identical paste skips parsing as well
+TEXT_MEMO_SIZE = 4096
+
+
+class MemoryBackend:
+    """LRU of key -> (headers, body) in this process, evicting by total body size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, headers, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (headers, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskBackend:
+    """One file per key under a directory shared by all workers; least recently read goes first"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Running estimate of the directory's size, corrected by every scan
+        self.size = 0
+        self.writes = 0
+        self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                headers = json.loads(f.readline())
+                body = f.read()
+            # mtime doubles as the last-used time for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return headers, body
+
+    def put(self, key, headers, body):
+        if len(body) > self.max_bytes:
+            return
+        # Written aside and renamed so readers never see a partial file
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(headers).encode('utf-8') + b'\n')
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            # Disk full, read-only or directory gone: the response is fine, just not cached
+            logger.warning('result cache write failed: %s', e)
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        with self._lock:
+            self.size += len(body)
+            self.writes += 1
+            due = self.size > self.max_bytes or self.writes >= EVICT_EVERY
+            if due:
+                self.writes = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Scan the directory and remove the least recently read entries until it fits"""
+        files = []
+        total = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError as e:
+            logger.warning('result cache eviction failed: %s', e)
+            return
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        files.sort()
+        if total <= self.max_bytes:
+            files = []
+        for _, size, path in files:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self.size = total
+
+
+class ResultCache:
+    """Serves repeat submissions from stored, already-compressed response bytes.
+
+    The key hashes the parsed entries together with the snapshot version and
+    the response variant (encoding, streaming), and doubles as the ETag.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.text_memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        max_bytes = int(RESULT_CACHE_MB * 1024 * 1024)
+        if RESULT_CACHE == 'disk':
+            return cls(DiskBackend(RESULT_CACHE_DIR, max_bytes))
+        if RESULT_CACHE == 'memory':
+            return cls(MemoryBackend(max_bytes))
+        return cls(None)
+
+    def init_app(self, app):
+        # Register before the compressor: after_request hooks run in reverse
+        # order, so this one sees the compressed body
+        app.after_request(self.after_request)
+
+    def entries_digest(self, card_text, parse):
+        """Digest of the parsed entries for a paste: (digest, entries or None if parsing was skipped)"""
+        text_key = hashlib.sha256(card_text.encode('utf-8')).hexdigest()
+        with self._memo_lock:
+            digest = self.text_memo.get(text_key)
+            if digest is not None:
+                self.text_memo.move_to_end(text_key)
+                return digest, None
+
+        entries = list(parse(card_text))
+        # Same list in another format or spacing parses to the same entries
+        canonical = json.dumps([[entry['name'], entry['quantity'], entry['foil'], entry['set'],
+                                 entry['collector_number'], entry['section']]
+                                for entry in entries], separators=(',', ':'))
+        digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        with self._memo_lock:
+            self.text_memo[text_key] = digest
+            if len(self.text_memo) > TEXT_MEMO_SIZE:
+                self.text_memo.popitem(last=False)
+        return digest, entries
+
+    def key(self, entries_digest, snapshot_version, *variant):
+        """Cache key (and ETag) for one response variant of a parsed list against a snapshot"""
+        parts = json.dumps([CACHE_FORMAT, CODE_VERSION, NAME_KEY_VERSION, entries_digest, snapshot_version,
+                            *variant])
+        return hashlib.sha256(parts.encode('utf-8')).hexdigest()[:32]
+
+    def respond(self, key):
+        """A 304 or cached response for this key, or None to compute it (and cache it on the way out)"""
+        if self.backend is None:
+            return None
+        g.result_cache_key = key
+
+        if key in request.if_none_match:
+            response = Response(status=304)
+        else:
+            cached = self.backend.get(key)
+            if cached is None:
+                return None
+            headers, body = cached
+            response = Response(body, headers=headers)
+        g.result_cache_hit = True
+        response.set_etag(key)
+        response.vary.add('Accept-Encoding')
+        response.headers['X-Result-Cache'] = 'hit'
+        return response
+
+    def skip(self):
+        """Don't store this request's response: it depends on more than its key"""
+        g.pop('result_cache_key', None)
+
+    def after_request(self, response):
+        key = g.get('result_cache_key')
+        if key is None or g.get('result_cache_hit') or response.status_code != 200:
+            return response
+
+        response.set_etag(key)
+        response.headers['X-Result-Cache'] = 'miss'
+        headers = {name: response.headers[name]
+                   for name in ('Content-Type', 'Content-Encoding') if name in response.headers}
+        if response.is_streamed:
+            response.response = self._tee(key, headers, response.response)
+        else:
+            self.backend.put(key, headers, response.get_data())
+        return response
+
+    def _tee(self, key, headers, chunks):
+        """Pass a stream through, storing it once it has been sent in full"""
+        sent = []
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if sent is not None:
+                sent.append(chunk)
+                size += len(chunk)
+                if size > self.backend.max_bytes:
+                    # Too big to keep; stop holding on to it
+                    sent = None
+            yield chunk
+        if sent is not None:
+            self.backend.put(key, headers, b''.join(sent))
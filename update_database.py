@@ -14,10 +14,11 @@ def main():
         db = MTGDatabase('data/mtg_cards.sqlite')
         db.initialize()
         
-        # Always update in GitHub Actions (fresh each time)
-        print("Downloading latest card data from Scryfall...")
-        gzip_path = db.download_bulk_data()
-        db.process_bulk_data(gzip_path)
+        # Skips the download when Scryfall's bulk metadata (updated_at / ETag) matches the last build
+        print("Checking Scryfall for new card data...")
+        if not db.update_snapshot():
+            print(f"{datetime.now()}: No new or changed cards, nothing to do.")
+            return True
         
         print(f"{datetime.now()}: Database update complete!")
         return True